@@ -0,0 +1,174 @@
+"""
+Ekumen - Worker Agent
+Registers with a coordinator Ekumen instance, pulls queued jobs and runs them
+with a local AnsibleRunner, streaming output back as it arrives.
+
+Usage:
+    python agent.py --coordinator http://127.0.0.1:5000 --name agent-1 --groups dc1 --capacity 2
+"""
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from ansible_runner import AnsibleRunner
+from backends import create_backend
+from config import Config
+
+# Attempts at reporting a finished job before giving up on it
+REPORT_RETRIES = 8
+
+
+class OutputStreamer:
+    """Buffers runner output and forwards it to the coordinator in batches."""
+
+    def __init__(self, agent, job_id, flush_interval=1.0, max_buffer=16384):
+        self.agent = agent
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, chunk):
+        self._buffer.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_buffer or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.agent.post(f'/jobs/{self.job_id}/output', {'output': ''.join(self._buffer)})
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+
+class Agent:
+    """A worker agent that executes jobs on behalf of a coordinator."""
+
+    def __init__(self, coordinator, name, groups=None, capacity=1, token='', poll_interval=2.0):
+        self.coordinator = coordinator.rstrip('/')
+        self.name = name
+        self.groups = groups or []
+        self.capacity = capacity
+        self.token = token
+        self.poll_interval = poll_interval
+        # An agent always executes locally; 'agent' would only queue the job again
+        backend = Config.EXECUTION_BACKEND if Config.EXECUTION_BACKEND != 'agent' else 'auto'
+        options = {'delay': Config.MOCK_DELAY} if backend == 'mock' else {}
+        self.runner = AnsibleRunner(default_shards=Config.SHARD_COUNT,
+                                    backend=create_backend(backend, **options))
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def post(self, path, data):
+        """POST JSON to the coordinator and return the decoded response."""
+        req = urllib.request.Request(
+            self.coordinator + path,
+            data=json.dumps(data).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'X-Ekumen-Agent-Token': self.token},
+            method='POST'
+        )
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    def _identity(self):
+        return {'name': self.name, 'groups': self.groups, 'capacity': self.capacity}
+
+    def _report(self, job_id, result):
+        """
+        Send a job's final result, retrying while the coordinator is
+        unreachable. A job that is never reported is failed by the
+        coordinator once this agent stops sending heartbeats.
+        """
+        for attempt in range(REPORT_RETRIES):
+            try:
+                self.post(f'/jobs/{job_id}/complete', {
+                    'success': result.get('success', False),
+                    'error': result.get('error', '')
+                })
+                return True
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print(f"   Job {job_id} failed to report (attempt {attempt + 1}): {e}")
+                time.sleep(min(2 ** attempt, 30))
+        return False
+
+    def _execute(self, job):
+        """Run a claimed job and report the result back."""
+        streamer = OutputStreamer(self, job['id'])
+        try:
+            try:
+                result = self.runner.run(job['payload'], on_output=streamer.write)
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            try:
+                streamer.flush()
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print(f"   Job {job['id']} lost output: {e}")
+            self._report(job['id'], result)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def run_forever(self):
+        """Poll the coordinator for work until interrupted."""
+        self.post('/agents/register', self._identity())
+        print(f"🛰️  Agent {self.name} registered with {self.coordinator}")
+
+        while True:
+            job = None
+            with self._lock:
+                has_capacity = self._active < self.capacity
+            try:
+                if has_capacity:
+                    job = self.post(f'/agents/{self.name}/claim', self._identity()).get('job')
+                else:
+                    self.post('/agents/register', self._identity())
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print(f"   Coordinator unavailable: {e}")
+
+            if job:
+                print(f"   Running job {job['id']}")
+                with self._lock:
+                    self._active += 1
+                threading.Thread(target=self._execute, args=(job,), daemon=True).start()
+                continue
+
+            time.sleep(self.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ekumen worker agent')
+    parser.add_argument('--coordinator', default=os.environ.get('EKUMEN_COORDINATOR', 'http://127.0.0.1:5000'))
+    parser.add_argument('--name', default=os.environ.get('EKUMEN_AGENT_NAME', socket.gethostname()))
+    parser.add_argument('--groups', default=os.environ.get('EKUMEN_AGENT_GROUPS', ''),
+                        help='Comma-separated routes this agent serves')
+    parser.add_argument('--capacity', type=int, default=int(os.environ.get('EKUMEN_AGENT_CAPACITY', 1)),
+                        help='Maximum concurrent jobs')
+    args = parser.parse_args()
+    if not Config.AGENT_TOKEN:
+        parser.error('set ANSIBLE_SHUTTLE_AGENT_TOKEN (the coordinator refuses agents without it)')
+
+    agent = Agent(
+        args.coordinator,
+        args.name,
+        groups=[g.strip() for g in args.groups.split(',') if g.strip()],
+        capacity=args.capacity,
+        token=Config.AGENT_TOKEN,
+        poll_interval=Config.AGENT_POLL_INTERVAL
+    )
+    try:
+        agent.run_forever()
+    except KeyboardInterrupt:
+        print(f"\n   Agent {args.name} stopped")
+
+
+if __name__ == '__main__':
+    main()
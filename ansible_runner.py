@@ -1,15 +1,19 @@
 """
 Ekumen - Runner Module
-Handles execution of Ansible ad-hoc commands and playbooks using pexpect
-to manage interactive password prompts.
+Validates Ansible ad-hoc commands and playbooks, builds their command lines
+and runs them through an execution backend (see backends.py).
 """
 
 import os
-import re
 import shutil
-import pexpect
-import shlex
 import tempfile
+import threading
+
+from backends import Backend, create_backend
+from inventory_manager import parse_inventory_hosts
+from inventory_validator import validate_inventory
+from output_parser import MERGED_RECAP_MARKER, parse_recap, format_recap
+from playbook_analyzer import shard_blockers
 
 # Safe modules allowed by default (can be overridden via config)
 SAFE_MODULES = [
@@ -19,27 +23,58 @@ SAFE_MODULES = [
     'hostname', 'cron', 'mount', 'sysctl', 'firewalld', 'iptables'
 ]
 
+# Inventory errors listed in a single response
+MAX_REPORTED_ERRORS = 20
+
+# Longer --limit values (shard and rerun host lists) are passed as an
+# '@file' so the command stays well under the kernel's 128 KiB per-argument
+# cap, which also applies to the single 'bash -c' string of the PTY backend
+LIMIT_ARG_MAX = 4096
+
+
+def limit_patterns(limit):
+    """Split a --limit value into patterns, as Ansible does: on ',' if present, else ':'."""
+    return [p.strip() for p in limit.split(',' if ',' in limit else ':') if p.strip()]
+
+
+def inventory_sources(data):
+    """
+    Inventory contents of a run. 'inventory_sources' holds several
+    inventories that are passed with one -i each; otherwise 'inventory'.
+    """
+    sources = data.get('inventory_sources') or [data.get('inventory', '')]
+    return [s.strip() if isinstance(s, str) else '' for s in sources]
+
+
 class AnsibleRunner:
-    def __init__(self, allowed_modules=None):
-        self.ansible_available = shutil.which('ansible') is not None
+    def __init__(self, allowed_modules=None, default_shards=0, backend='auto'):
+        self._ansible_available = None
         self.allowed_modules = allowed_modules if allowed_modules else SAFE_MODULES
+        # Shard count used when a sharded run doesn't specify one (0 = CPU count)
+        self.default_shards = default_shards
+        # A backend name or an already configured Backend instance
+        self.backend = backend if isinstance(backend, Backend) else create_backend(backend)
     
+    @property
+    def ansible_available(self):
+        """Whether the backend can run ansible (looked up once, on first use)."""
+        if self._ansible_available is None:
+            self._ansible_available = self.backend.available()
+        return self._ansible_available
+
     def _validate_inventory(self, inventory_content):
-        """Validate inventory content for basic safety."""
+        """Validate inventory content for basic safety (INI or YAML)."""
         if not inventory_content:
             return False, 'Inventory is required. Please provide at least one host.'
         
-        # Check for basic patterns (hostnames, IPs)
-        lines = inventory_content.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#') or line.startswith('['):
-                continue
-            # Simple validation: alphanumeric, dots, dashes, underscores
-            if not re.match(r'^[\w\.\-\:\@\[\]]+$', line.split()[0]):
-                return False, f'Invalid host format: {line}'
+        valid, errors = validate_inventory(inventory_content)
+        if valid:
+            return True, ''
         
-        return True, ''
+        shown = [f'Line {line_no}: {message}' for line_no, message in errors[:MAX_REPORTED_ERRORS]]
+        if len(errors) > MAX_REPORTED_ERRORS:
+            shown.append(f'... and {len(errors) - MAX_REPORTED_ERRORS} more')
+        return False, 'Invalid inventory:\n' + '\n'.join(shown)
     
     def _validate_module(self, module):
         """Validate module name against allowed list."""
@@ -51,101 +86,7 @@ class AnsibleRunner:
         
         return True, ''
 
-    def _run_with_pexpect(self, cmd, password, become_password=None, timeout=120, cwd=None, env=None):
-        """
-        Run a command using pexpect to handle SSH and sudo password prompts.
-        Returns (success, output, error)
-        """
-        try:
-            # properly quote command for pexpect
-            cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
-            
-            # Spawn the process with a proper PTY
-            child = pexpect.spawn('/bin/bash', ['-c', cmd_str], timeout=timeout, cwd=cwd, env=env, encoding='utf-8')
-            
-            output_buffer = []
-            ssh_password_sent = False
-            become_password_sent = False
-            
-            # Patterns to match - order matters!
-            patterns = [
-                r'SSH password:',                    # 0: Ansible SSH password prompt
-                r'BECOME password',                  # 1: Ansible become password prompt  
-                r'(?i)password:',                    # 2: Generic password prompt
-                r'(?i)yes/no',                       # 3: Host key confirmation (yes/no)
-                r'\(yes/no/\[fingerprint\]\)',       # 4: Alternative host key prompt
-                r'Are you sure you want to continue', # 5: Another host key prompt variant
-                pexpect.EOF,                         # 6: End of output
-                pexpect.TIMEOUT                      # 7: Timeout
-            ]
-            
-            max_iterations = 30
-            iteration = 0
-            
-            while iteration < max_iterations:
-                iteration += 1
-                try:
-                    index = child.expect(patterns, timeout=20)
-                    
-                    # Capture any output before the match
-                    if child.before:
-                        output_buffer.append(child.before)
-                    
-                    if index == 0:  # SSH password prompt
-                        child.sendline(password)
-                        ssh_password_sent = True
-                    elif index == 1:  # BECOME password prompt
-                        pwd_to_send = become_password if become_password else password
-                        child.sendline(pwd_to_send)
-                        become_password_sent = True
-                    elif index == 2:  # Generic password prompt
-                        # Determine which password to send based on what we've already sent
-                        if not ssh_password_sent:
-                            child.sendline(password)
-                            ssh_password_sent = True
-                        elif not become_password_sent:
-                            pwd_to_send = become_password if become_password else password
-                            child.sendline(pwd_to_send)
-                            become_password_sent = True
-                        else:
-                            # Already sent both, might be retrying
-                            child.sendline(password)
-                    elif index in [3, 4, 5]:  # Host key confirmation
-                        child.sendline('yes')
-                    elif index == 6:  # EOF - command finished
-                        break
-                    elif index == 7:  # Timeout
-                        # Check if process is still alive
-                        if not child.isalive():
-                            break
-                        continue
-                        
-                except pexpect.TIMEOUT:
-                    if not child.isalive():
-                        break
-                    continue
-                except pexpect.EOF:
-                    break
-            
-            # Wait for process to complete
-            child.close()
-            
-            # Get any remaining output
-            full_output = ''.join(str(x) for x in output_buffer if x)
-            
-            # Get exit status
-            success = child.exitstatus == 0 if child.exitstatus is not None else False
-            
-            return success, full_output, ''
-            
-        except pexpect.TIMEOUT:
-            return False, '', 'Command timed out'
-        except pexpect.EOF:
-            return False, '', 'Unexpected end of output'
-        except Exception as e:
-            return False, '', str(e)
-
-    def run(self, data):
+    def run(self, data, on_output=None):
         if not self.ansible_available:
             return {
                 'success': False,
@@ -153,23 +94,115 @@ class AnsibleRunner:
                 'error': 'Ansible is not installed or not in PATH. Please install Ansible to use this application.'
             }
 
+        # Validate inventory
+        for inventory_content in inventory_sources(data):
+            valid, error = self._validate_inventory(inventory_content)
+            if not valid:
+                return {'success': False, 'output': '', 'error': error}
+
+        if not self.backend.local:
+            # Sharding, if requested, is done by whoever runs the job
+            return self.backend.dispatch(data, on_output=on_output)
+
+        shards = self._shard_count(data)
+        if shards > 1:
+            return self._run_sharded(data, shards, on_output=on_output)
+
+        return self._run_single(data, on_output=on_output)
+
+    def _shard_count(self, data):
+        """Number of parallel sub-runs requested for this run (1 = unsharded)."""
+        if not data.get('sharded'):
+            return 1
+        try:
+            count = int(data.get('shards') or 0)
+        except (TypeError, ValueError):
+            count = 0
+        return max(1, count or self.default_shards or os.cpu_count() or 1)
+
+    def _run_sharded(self, data, shards, on_output=None):
+        """
+        Split the inventory hosts into shards and run each as a parallel
+        --limit sub-run, then merge output and recap into one result.
+        """
+        hosts = list(dict.fromkeys(h for content in inventory_sources(data) for h in parse_inventory_hosts(content)))
+        if data.get('limit', '').strip() or len(hosts) < 2:
+            # A user limit can't be combined with a host-list limit reliably
+            return self._run_single(data, on_output=on_output)
+
+        blockers = shard_blockers(data.get('playbook', '')) if data.get('mode', 'adhoc') != 'adhoc' else []
+        if blockers:
+            # Each shard is a full playbook run; these would run once per shard
+            note = f'=== NOT SHARDED: {"; ".join(blockers)} ===\n'
+            if on_output:
+                on_output(note)
+            result = self._run_single(data, on_output=on_output)
+            return dict(result, output=note + result['output'])
+
+        shards = min(shards, len(hosts))
+        host_shards = [hosts[i::shards] for i in range(shards)]
+        output_lock = threading.Lock()
+
+        def run_shard(shard_hosts):
+            pending = []
+
+            def emit(chunk):
+                # Forward whole lines only so shards don't interleave mid-line
+                pending.append(chunk)
+                text = ''.join(pending)
+                if '\n' in text:
+                    complete, _, rest = text.rpartition('\n')
+                    pending[:] = [rest] if rest else []
+                    with output_lock:
+                        on_output(complete + '\n')
+
+            shard_data = dict(data, limit=','.join(shard_hosts), sharded=False)
+            result = self._run_single(shard_data, on_output=emit if on_output else None)
+            if on_output and pending:
+                with output_lock:
+                    on_output(''.join(pending))
+            return result
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=shards) as executor:
+            results = list(executor.map(run_shard, host_shards))
+
+        output_parts = []
+        errors = []
+        for i, (shard_hosts, result) in enumerate(zip(host_shards, results), 1):
+            output_parts.append(f'=== SHARD {i}/{shards} ({len(shard_hosts)} hosts) ===\n{result["output"]}')
+            if result['error']:
+                errors.append(f'[shard {i}] {result["error"]}')
+
+        output = '\n'.join(output_parts)
+        recap = parse_recap(output)
+        if recap:
+            output += f'\n{MERGED_RECAP_MARKER}\n' + format_recap(recap) + '\n'
+
+        return {
+            'success': all(r['success'] for r in results),
+            'output': output,
+            'error': '\n'.join(errors)
+        }
+
+    def _run_single(self, data, on_output=None):
+        """Run one ansible or ansible-playbook process for the request."""
         mode = data.get('mode', 'adhoc')
-        inventory_content = data.get('inventory', '').strip()
         username = data.get('username', '').strip()
         password = data.get('password', '')
-        
-        # Validate inventory
-        valid, error = self._validate_inventory(inventory_content)
-        if not valid:
-            return {'success': False, 'output': '', 'error': error}
 
         temp_dir = tempfile.mkdtemp(prefix='ansible_runner_')
         
         try:
-            # Create inventory file
-            inventory_path = os.path.join(temp_dir, 'inventory')
-            with open(inventory_path, 'w') as f:
-                f.write(inventory_content)
+            # Create inventory files, one -i each (no extension, so ansible
+            # picks the INI or YAML plugin from the content)
+            inventory_args = []
+            for i, inventory_content in enumerate(inventory_sources(data), 1):
+                inventory_path = os.path.join(temp_dir, 'inventory' if i == 1 else f'inventory_{i}')
+                with open(inventory_path, 'w') as f:
+                    f.write(inventory_content)
+                inventory_args.extend(['-i', inventory_path])
             
             env = os.environ.copy()
             
@@ -180,7 +213,7 @@ class AnsibleRunner:
                 cmd = [
                     'ansible',
                     'all',
-                    '-i', inventory_path,
+                    *inventory_args,
                     '-m', module
                 ]
                 
@@ -203,7 +236,7 @@ class AnsibleRunner:
                 
                 cmd = [
                     'ansible-playbook',
-                    '-i', inventory_path,
+                    *inventory_args,
                     playbook_path
                 ]
             
@@ -213,9 +246,20 @@ class AnsibleRunner:
             
             # Limit pattern (optional)
             limit = data.get('limit', '').strip()
+            if len(limit) > LIMIT_ARG_MAX:
+                # Ansible reads '@file' limits one pattern per line
+                limit_path = os.path.join(temp_dir, 'limit')
+                with open(limit_path, 'w') as f:
+                    f.write('\n'.join(limit_patterns(limit)) + '\n')
+                limit = '@' + limit_path
             if limit:
                 cmd.extend(['--limit', limit])
             
+            # Parallelism (optional)
+            forks = data.get('forks')
+            if forks:
+                cmd.extend(['--forks', str(int(forks))])
+            
             # Privilege escalation
             become = data.get('become', True)
             become_method = data.get('become_method', 'sudo')
@@ -245,13 +289,14 @@ class AnsibleRunner:
                 cmd.append(f'-{verbosity}')
             
             # Execute
-            success, output, error = self._run_with_pexpect(
+            success, output, error = self.backend.execute(
                 cmd, 
                 password, 
                 become_password=become_password,
                 timeout=600, # 10 minutes timeout
                 cwd=temp_dir, 
-                env=env
+                env=env,
+                on_output=on_output
             )
             
             return {
@@ -3,16 +3,107 @@ Ekumen - Web Application
 A Flask-based single-page app for running Ansible playbooks and ad-hoc commands.
 """
 
+import datetime
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache, wraps
 from flask import Flask, render_template, request, jsonify, Response
-from ansible_runner import AnsibleRunner
-from inventory_manager import InventoryManager
+from ansible_runner import AnsibleRunner, SAFE_MODULES, inventory_sources
+from backends import BACKENDS, create_backend
+from inventory_manager import InventoryManager, match_hosts, merge_inventory_groups, parse_inventory_hosts
+from inventory_validator import validate_inventory
+from host_index import HostIndex
+from job_manager import JobManager
+from scheduler import ScheduleManager, Scheduler
 from config import Config
+from output_parser import split_adhoc_output
+from playbook_analyzer import PlaybookAnalyzer
+from rate_limiter import RateLimiter
+from result_cache import ResultCache
+from storage import VersionedStore
+from assets import AssetPipeline
+
+if Config.EXECUTION_BACKEND not in BACKENDS:
+    # Fail the worker boot instead of answering every request with a 500
+    raise ValueError(f'Unknown execution backend "{Config.EXECUTION_BACKEND}" in ANSIBLE_SHUTTLE_BACKEND. '
+                     f'Available: {", ".join(sorted(BACKENDS))}')
+if Config.EXECUTION_BACKEND == 'agent' and not Config.AGENT_TOKEN:
+    raise ValueError('The agent backend needs ANSIBLE_SHUTTLE_AGENT_TOKEN; agents cannot claim jobs without it')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = Config.SECRET_KEY
+if Config.TRUSTED_PROXIES:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+
+    # Take the client address from the proxies' X-Forwarded-For
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXIES, x_proto=Config.TRUSTED_PROXIES)
+assets = AssetPipeline(app)
+
+
+# ========== SERVICES ==========
+# Built on first use, so importing the app (every worker boot) does no
+# filesystem or PATH lookups.
+
+@lru_cache(maxsize=None)
+def get_backend():
+    name = Config.EXECUTION_BACKEND
+    if name == 'agent':
+        return create_backend(name, job_manager=get_job_manager(),
+                              route=Config.BACKEND_ROUTE or None, timeout=Config.COMMAND_TIMEOUT)
+    if name == 'mock':
+        return create_backend(name, delay=Config.MOCK_DELAY)
+    return create_backend(name)
 
-runner = AnsibleRunner()
-inventory_manager = InventoryManager(Config.INVENTORY_DIR)
+@lru_cache(maxsize=None)
+def get_runner():
+    return AnsibleRunner(default_shards=Config.SHARD_COUNT, backend=get_backend())
+
+@lru_cache(maxsize=None)
+def get_inventory_manager():
+    return InventoryManager(Config.INVENTORY_DIR)
+
+@lru_cache(maxsize=None)
+def get_host_index():
+    return HostIndex(Config.HOST_INDEX_PATH, retention_days=Config.HOST_INDEX_RETENTION_DAYS)
+
+@lru_cache(maxsize=None)
+def get_job_manager():
+    return JobManager(Config.JOB_DIR, host_index=get_host_index(), agent_timeout=Config.AGENT_TIMEOUT,
+                      run_timeout=Config.COMMAND_TIMEOUT + Config.AGENT_TIMEOUT, rate_limiter=get_rate_limiter())
+
+@lru_cache(maxsize=None)
+def get_schedule_manager():
+    return ScheduleManager(Config.SCHEDULE_DIR)
+
+@lru_cache(maxsize=None)
+def get_playbook_store():
+    return VersionedStore(Config.PLAYBOOK_DIR)
+
+@lru_cache(maxsize=None)
+def get_playbook_analyzer():
+    return PlaybookAnalyzer(Config.PLAYBOOK_DIR, get_runner().allowed_modules)
+
+@lru_cache(maxsize=None)
+def get_result_cache():
+    # Only modules from SAFE_MODULES may be cached, whatever the configuration says
+    return ResultCache(
+        [m for m in Config.CACHEABLE_MODULES if m in SAFE_MODULES],
+        default_ttl=Config.CACHE_TTL, max_ttl=Config.CACHE_MAX_TTL, cache_dir=Config.CACHE_DIR or None
+    )
+
+@lru_cache(maxsize=None)
+def get_rate_limiter():
+    return RateLimiter(
+        Config.RATE_LIMIT_DIR,
+        runs_per_minute=Config.RATE_LIMIT_RUNS_PER_MINUTE,
+        max_concurrent=Config.RATE_LIMIT_CONCURRENT,
+        hosts_per_hour=Config.RATE_LIMIT_HOSTS_PER_HOUR,
+        lease_ttl=Config.COMMAND_TIMEOUT + 300
+    )
 
 # Store last output for download (simple in-memory cache)
 last_output = {'content': '', 'timestamp': None}
@@ -21,24 +112,166 @@ last_output = {'content': '', 'timestamp': None}
 @app.route('/')
 def index():
     """Serve the main single-page application."""
-    return render_template('index.html', ansible_available=runner.ansible_available, version=Config.VERSION)
+    return render_template('index.html', ansible_available=get_runner().ansible_available, version=Config.VERSION)
+
+
+def client_identity():
+    """The caller that rate limits apply to: the proxy's user header, or the client IP."""
+    if Config.RATE_LIMIT_USER_HEADER:
+        user = request.headers.get(Config.RATE_LIMIT_USER_HEADER, '').strip()
+        if user:
+            return 'user:' + user
+    return 'ip:' + (request.remote_addr or 'unknown')
+
+
+def count_target_hosts(data):
+    """Number of inventory hosts a run would target."""
+    groups = merge_inventory_groups(inventory_sources(data))
+    return len(match_hosts('all', groups, data.get('limit', '').strip() or None))
+
+
+def acquire_run_slot(hosts=0, detached=False):
+    """
+    Apply the caller's rate limits to a run. A detached lease belongs to a
+    queued job and is released when the job finishes.
+    Returns (lease, None) when admitted, or (None, 429 response).
+    """
+    limiter = get_rate_limiter()
+    if not limiter.enabled:
+        return None, None
+    success, result = limiter.acquire(client_identity(), hosts=hosts, detached=detached)
+    if success:
+        return result, None
+    response = jsonify({'success': False, 'output': '', 'error': result['error']})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(result['retry_after'])
+    return None, response
+
+
+def release_run_slot(lease):
+    if lease:
+        get_rate_limiter().release(client_identity(), lease)
+
+
+def acquire_job_slot(payload):
+    """
+    Apply the caller's rate limits to a queued job. Returns (job lease, None)
+    when admitted, or (None, 429 response); the job manager releases the
+    lease when the job finishes.
+    """
+    hosts = count_target_hosts(payload) if Config.RATE_LIMIT_HOSTS_PER_HOUR else 0
+    lease, limited = acquire_run_slot(hosts, detached=True)
+    return ({'key': client_identity(), 'id': lease} if lease else None), limited
 
 
 @app.route('/run', methods=['POST'])
 def run_ansible():
     """Execute Ansible ad-hoc command or playbook."""
-    global last_output
-    
     data = request.get_json()
     
     # Basic input validation
     if not data:
         return jsonify({'success': False, 'output': '', 'error': 'Invalid request data'})
     
-    result = runner.run(data)
+    lease = None
+    if not get_result_cache().is_cached(data):  # Cache hits don't start a run
+        hosts = count_target_hosts(data) if Config.RATE_LIMIT_HOSTS_PER_HOUR else 0
+        lease, limited = acquire_run_slot(hosts)
+        if limited:
+            return limited
+    started = time.time()
+    try:
+        result = get_result_cache().get_or_run(data, get_runner().run)
+    finally:
+        release_run_slot(lease)
+    store_last_output(result)
+    if not result.get('cached'):
+        result = record_run_result(data, result, started)
     
-    # Store output for download
-    import datetime
+    return jsonify(result)
+
+
+@app.route('/usage', methods=['GET'])
+def get_usage():
+    """The caller's run usage and remaining rate limit allowance."""
+    return jsonify({'success': True, 'usage': get_rate_limiter().usage(client_identity())})
+
+
+@app.route('/run/batch', methods=['POST'])
+def run_batch():
+    """
+    Run one ad-hoc module across several saved inventories in a single
+    ansible process and return the results split per source inventory.
+    """
+    data = request.get_json()
+    if not data or not data.get('inventories'):
+        return jsonify({'success': False, 'output': '', 'error': 'A list of inventory names is required'}), 400
+
+    sources = {}
+    missing = []
+    for name in data['inventories']:
+        success, content = get_inventory_manager().get_inventory(name)
+        if success:
+            sources[name] = content
+        else:
+            missing.append(name)
+    if missing:
+        return jsonify({'success': False, 'output': '', 'error': f"Inventories not found: {', '.join(missing)}"}), 404
+
+    # Each source is its own -i; ansible merges them and contacts shared hosts once
+    membership = {name: parse_inventory_hosts(content) for name, content in sources.items()}
+    host_count = len({h for hosts in membership.values() for h in hosts})
+
+    run_data = dict(data, mode='adhoc', inventory_sources=list(sources.values()))
+    run_data.pop('inventories')
+    run_data.pop('inventory', None)
+    run_data['forks'] = max(1, min(host_count, Config.BATCH_MAX_FORKS))
+
+    lease, limited = acquire_run_slot(host_count)
+    if limited:
+        return limited
+    started = time.time()
+    try:
+        result = get_runner().run(run_data)
+    finally:
+        release_run_slot(lease)
+    store_last_output(result)
+    result = record_run_result(run_data, result, started, source='batch')
+
+    sections = split_adhoc_output(result.get('output', ''))
+    result['hosts'] = host_count
+    result['inventories'] = {
+        name: {host: sections.get(host, {'status': 'UNKNOWN', 'output': ''}) for host in hosts}
+        for name, hosts in membership.items()
+    }
+    return jsonify(result)
+
+
+def default_job_route():
+    """Where jobs without a route go: the leader's local runner, or the agents with the agent backend."""
+    return (Config.BACKEND_ROUTE or None) if not get_backend().local else 'local'
+
+
+def record_run_result(data, result, started=None, source='run'):
+    """
+    Keep a synchronous run as a finished job (failed hosts, output) so it
+    can be rerun and diffed, and queue it for the host index.
+    Returns the result with the job's id.
+    """
+    if not result.get('output') or result.get('job_id'):
+        return result  # Nothing ran, or it ran as a job that records itself
+    success, job_id = get_job_manager().record_run(data, result, route=default_job_route(),
+                                                   source=source, started=started)
+    if not success:
+        module = data.get('module', 'ping') if data.get('mode', 'adhoc') == 'adhoc' else 'playbook'
+        get_host_index().record_later(result['output'], module=module)
+        return result
+    return dict(result, job_id=job_id)
+
+
+def store_last_output(result):
+    """Keep a run's output for /download."""
+    global last_output
     output_text = result.get('output', '')
     if result.get('error'):
         output_text += f"\n\n--- STDERR ---\n{result['error']}"
@@ -47,8 +280,6 @@ def run_ansible():
         'content': output_text,
         'timestamp': datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
     }
-    
-    return jsonify(result)
 
 
 @app.route('/download')
@@ -66,9 +297,47 @@ def download_output():
     )
 
 
+# ========== HOST INDEX ==========
+
+@app.route('/hosts', methods=['GET'])
+def query_hosts():
+    """
+    Query the host index. Filters: status, module, since (seconds),
+    fact=name=glob (repeatable), host (glob) and limit.
+    With module or since, status matches runs in that window rather than
+    each host's last status.
+    """
+    facts = []
+    for fact in request.args.getlist('fact'):
+        name, sep, pattern = fact.partition('=')
+        if not sep:
+            return jsonify({'success': False, 'error': f'fact must be name=value: {fact}'}), 400
+        facts.append((name, pattern))
+    try:
+        since = float(request.args['since']) if request.args.get('since') else None
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since and limit must be numbers'}), 400
+
+    success, result = get_host_index().query(
+        status=request.args.get('status'), module=request.args.get('module'), since=since,
+        facts=facts, host=request.args.get('host'), limit=limit
+    )
+    if not success:
+        return jsonify({'success': False, 'error': result}), 500
+    return jsonify({'success': True, 'hosts': result})
+
+
+@app.route('/hosts/<host>', methods=['GET'])
+def get_indexed_host(host):
+    """A host's last status, last facts and recent results."""
+    success, result = get_host_index().get_host(host)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404 if result == 'Host not found' else 500
+    return jsonify({'success': True, 'host': result})
+
+
 # ========== PLAYBOOK LIBRARY ==========
-import os
-import re
 
 def get_playbook_dir():
     """Get playbook directory, create if not exists."""
@@ -104,22 +373,49 @@ def list_playbooks():
     playbooks.sort()
     return jsonify({'playbooks': playbooks})
 
-@app.route('/playbooks/<name>', methods=['GET'])
-def get_playbook(name):
-    """Get playbook content by name."""
-    playbook_dir = get_playbook_dir()
-    safe_name = sanitize_filename(name)
-    path = os.path.join(playbook_dir, safe_name)
-    
+def read_playbook(name):
+    """Read a saved playbook. Returns (success, content_or_error)."""
+    path = os.path.join(get_playbook_dir(), sanitize_filename(name))
     if not os.path.exists(path):
-        return jsonify({'success': False, 'error': 'Playbook not found'}), 404
-    
+        return False, 'Playbook not found'
     try:
         with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return jsonify({'success': True, 'name': safe_name, 'content': content})
+            return True, f.read()
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return False, str(e)
+
+@app.route('/playbooks/analyze', methods=['POST'])
+def analyze_playbook():
+    """
+    Pre-flight analysis of a playbook (inline "playbook" or saved "name"):
+    plays, tasks, modules, tags and, given an inventory, the estimated
+    host x task count.
+    """
+    data = request.get_json()
+    if not data or not (data.get('playbook') or data.get('name')):
+        return jsonify({'success': False, 'error': 'Playbook content or name required'}), 400
+
+    content = data.get('playbook')
+    if not content:
+        success, content = read_playbook(data['name'])
+        if not success:
+            return jsonify({'success': False, 'error': content}), 404
+
+    success, result = get_playbook_analyzer().analyze(
+        content, inventory=data.get('inventory', ''), limit=data.get('limit', '')
+    )
+    if not success:
+        return jsonify({'success': False, 'error': result}), 400
+    return jsonify({'success': True, 'analysis': result})
+
+@app.route('/playbooks/<name>', methods=['GET'])
+def get_playbook(name):
+    """Get playbook content by name."""
+    success, result = read_playbook(name)
+    if not success:
+        status = 404 if result == 'Playbook not found' else 500
+        return jsonify({'success': False, 'error': result}), status
+    return jsonify({'success': True, 'name': sanitize_filename(name), 'content': result})
 
 @app.route('/playbooks', methods=['POST'])
 def save_playbook():
@@ -128,16 +424,13 @@ def save_playbook():
     if not data or 'name' not in data or 'content' not in data:
         return jsonify({'success': False, 'error': 'Name and content required'}), 400
     
-    playbook_dir = get_playbook_dir()
+    get_playbook_dir()
     safe_name = sanitize_filename(data['name'])
-    path = os.path.join(playbook_dir, safe_name)
     
-    try:
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(data['content'])
-        return jsonify({'success': True, 'name': safe_name})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    success, result = get_playbook_store().write(safe_name, data['content'])
+    if not success:
+        return jsonify({'success': False, 'error': result}), 500
+    return jsonify({'success': True, 'name': safe_name, 'version': result})
 
 @app.route('/playbooks/<name>', methods=['DELETE'])
 def delete_playbook(name):
@@ -155,20 +448,58 @@ def delete_playbook(name):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/playbooks/<name>/versions', methods=['GET'])
+def list_playbook_versions(name):
+    """List saved versions of a playbook, oldest first."""
+    return jsonify({'versions': get_playbook_store().versions(sanitize_filename(name))})
+
+@app.route('/playbooks/<name>/versions/<version>', methods=['GET'])
+def get_playbook_version(name, version):
+    """Get one version of a playbook by hash, hash prefix or 1-based index."""
+    success, result = get_playbook_store().read_version(sanitize_filename(name), version)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404
+    return jsonify({'success': True, 'name': sanitize_filename(name), 'content': result})
+
+@app.route('/playbooks/<name>/diff', methods=['GET'])
+def diff_playbook_versions(name):
+    """Unified diff between two playbook versions (?from=&to=, default previous..latest)."""
+    success, result = get_playbook_store().diff(
+        sanitize_filename(name), request.args.get('from'), request.args.get('to')
+    )
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404
+    return jsonify({'success': True, 'diff': result})
+
 
 # ========== INVENTORY LIBRARY ==========
 
 @app.route('/inventories', methods=['GET'])
 def list_inventories():
     """List all saved inventories."""
-    inventories = inventory_manager.list_inventories()
+    inventories = get_inventory_manager().list_inventories()
     return jsonify({'inventories': inventories})
 
 
+@app.route('/inventories/validate', methods=['POST'])
+def validate_inventory_content():
+    """Validate INI or YAML inventory content and report every error with its line."""
+    data = request.get_json()
+    if not data or 'content' not in data:
+        return jsonify({'success': False, 'error': 'Content required'}), 400
+
+    valid, errors = validate_inventory(data['content'])
+    return jsonify({
+        'success': True,
+        'valid': valid,
+        'errors': [{'line': line_no, 'message': message} for line_no, message in errors]
+    })
+
+
 @app.route('/inventories/<name>', methods=['GET'])
 def get_inventory(name):
     """Get inventory content by name."""
-    success, result = inventory_manager.get_inventory(name)
+    success, result = get_inventory_manager().get_inventory(name)
     if not success:
         return jsonify({'success': False, 'error': result}), 404
     return jsonify({'success': True, 'name': name, 'content': result})
@@ -181,23 +512,340 @@ def save_inventory():
     if not data or 'name' not in data or 'content' not in data:
         return jsonify({'success': False, 'error': 'Name and content required'}), 400
 
-    success, result = inventory_manager.save_inventory(data['name'], data['content'])
+    success, result = get_inventory_manager().save_inventory(data['name'], data['content'])
     if not success:
         return jsonify({'success': False, 'error': result}), 500
     return jsonify({'success': True, 'name': result})
 
 
+@app.route('/inventories/<name>/versions', methods=['GET'])
+def list_inventory_versions(name):
+    """List saved versions of an inventory, oldest first."""
+    return jsonify({'versions': get_inventory_manager().list_versions(name)})
+
+
+@app.route('/inventories/<name>/versions/<version>', methods=['GET'])
+def get_inventory_version(name, version):
+    """Get one version of an inventory by hash, hash prefix or 1-based index."""
+    success, result = get_inventory_manager().get_version(name, version)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404
+    return jsonify({'success': True, 'name': name, 'content': result})
+
+
+@app.route('/inventories/<name>/diff', methods=['GET'])
+def diff_inventory_versions(name):
+    """Unified diff between two inventory versions (?from=&to=, default previous..latest)."""
+    success, result = get_inventory_manager().diff_versions(
+        name, request.args.get('from'), request.args.get('to')
+    )
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404
+    return jsonify({'success': True, 'diff': result})
+
+
 @app.route('/inventories/<name>', methods=['DELETE'])
 def delete_inventory(name):
     """Delete an inventory."""
-    success, error = inventory_manager.delete_inventory(name)
+    success, error = get_inventory_manager().delete_inventory(name)
     if not success:
         return jsonify({'success': False, 'error': error}), 404
     return jsonify({'success': True})
 
 
+# ========== JOB QUEUE & WORKER AGENTS ==========
+
+def agent_auth_required(f):
+    """
+    Require the shared agent token. Without one the agent routes are closed:
+    behind a reverse proxy every caller looks like localhost, and claims
+    hand out job passwords.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not Config.AGENT_TOKEN:
+            return jsonify({'success': False, 'error': 'Agent token not configured'}), 403
+        if not hmac.compare_digest(request.headers.get('X-Ekumen-Agent-Token', ''), Config.AGENT_TOKEN):
+            return jsonify({'success': False, 'error': 'Invalid agent token'}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+
+@app.route('/usage/all', methods=['GET'])
+@agent_auth_required
+def get_all_usage():
+    """Run usage of every caller, busiest first (agent token required)."""
+    return jsonify({'success': True, 'usage': get_rate_limiter().all_usage()})
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a run for execution by a worker agent."""
+    data = request.get_json()
+    if not data:
+        return jsonify({'success': False, 'error': 'Invalid request data'}), 400
+
+    route = data.pop('route', None) or None
+    lease, limited = acquire_job_slot(data)
+    if limited:
+        return limited
+    success, result = get_job_manager().create_job(data, route=route, lease=lease)
+    if not success:
+        release_run_slot(lease and lease['id'])
+        return jsonify({'success': False, 'error': result}), 500
+    return jsonify({'success': True, 'job_id': result})
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """List recent jobs, optionally filtered by status."""
+    jobs = get_job_manager().list_jobs(status=request.args.get('status'))
+    return jsonify({'jobs': jobs})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get a job record together with its output so far."""
+    success, result = get_job_manager().get_job(job_id)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404
+    return jsonify({'success': True, 'job': result, 'output': get_job_manager().get_output(job_id)})
+
+
+@app.route('/jobs/<job_id>/rerun', methods=['POST'])
+def rerun_job(job_id):
+    """
+    Queue a new job limited to the hosts that failed in this one
+    (?only=failed, the default), only the unreachable ones (?only=unreachable)
+    or the whole run again (?only=all). Passwords may be passed in the body.
+    """
+    data = request.get_json(silent=True) or {}
+    only = request.args.get('only', 'failed')
+    success, payload = get_job_manager().rerun_payload(job_id, only=only, secrets=data)
+    if not success:
+        status = 404 if payload == 'Job not found' else 400
+        return jsonify({'success': False, 'error': payload}), status
+
+    lease, limited = acquire_job_slot(payload)
+    if limited:
+        return limited
+    success, result = get_job_manager().rerun_job(job_id, only=only, secrets=data, lease=lease)
+    if not success:
+        release_run_slot(lease and lease['id'])
+        return jsonify({'success': False, 'error': result}), 500
+    return jsonify({'success': True, 'job_id': result})
+
+
+@app.route('/jobs/<job_id>/diff/<other_id>', methods=['GET'])
+def diff_jobs(job_id, other_id):
+    """
+    Per-host diff of two jobs' output: only hosts that changed, were added
+    or were removed. ?ignore=<regex> drops volatile lines such as timestamps.
+    """
+    success, result = get_job_manager().diff_jobs(job_id, other_id, ignore=request.args.get('ignore'))
+    if not success:
+        status = 404 if result.startswith('Job not found') else 400
+        return jsonify({'success': False, 'error': result}), status
+    return jsonify(dict(result, success=True))
+
+
+@app.route('/jobs/<job_id>/output', methods=['POST'])
+@agent_auth_required
+def append_job_output(job_id):
+    """Receive a chunk of streamed output from an agent."""
+    data = request.get_json() or {}
+    success, error = get_job_manager().append_output(job_id, data.get('output', ''))
+    if not success:
+        return jsonify({'success': False, 'error': error}), 404
+    return jsonify({'success': True})
+
+
+@app.route('/jobs/<job_id>/complete', methods=['POST'])
+@agent_auth_required
+def complete_job(job_id):
+    """Receive the final result of a job from an agent."""
+    data = request.get_json() or {}
+    success, error = get_job_manager().complete_job(job_id, data)
+    if not success:
+        return jsonify({'success': False, 'error': error}), 404
+    return jsonify({'success': True})
+
+
+@app.route('/agents', methods=['GET'])
+def list_agents():
+    """List worker agents seen recently."""
+    return jsonify({'agents': get_job_manager().list_agents(max_age=Config.AGENT_TIMEOUT)})
+
+
+@app.route('/agents/register', methods=['POST'])
+@agent_auth_required
+def register_agent():
+    """Register a worker agent (also used as its heartbeat)."""
+    data = request.get_json()
+    if not data or not data.get('name'):
+        return jsonify({'success': False, 'error': 'Agent name is required'}), 400
+
+    success, result = get_job_manager().register_agent(
+        data['name'], groups=data.get('groups', []), capacity=data.get('capacity', 1)
+    )
+    if not success:
+        return jsonify({'success': False, 'error': result}), 500
+    return jsonify({'success': True, 'agent': result})
+
+
+@app.route('/agents/<name>/claim', methods=['POST'])
+@agent_auth_required
+def claim_job(name):
+    """Hand the next matching queued job to an agent with free capacity."""
+    data = request.get_json(silent=True) or {}
+    success, agent = get_job_manager().register_agent(
+        name, groups=data.get('groups', []), capacity=data.get('capacity', 1)
+    )
+    if not success:
+        return jsonify({'success': False, 'error': agent}), 400
+
+    running = len([j for j in get_job_manager().list_jobs(status='running', limit=None)
+                   if j.get('agent') == agent['name']])
+    if running >= agent['capacity']:
+        return jsonify({'success': True, 'job': None})
+
+    job = get_job_manager().claim_job(agent['name'], groups=agent['groups'])
+    return jsonify({'success': True, 'job': job})
+
+
+# ========== SCHEDULES ==========
+
+# Run options a schedule may carry over into its jobs (passwords are never stored)
+SCHEDULE_RUN_FIELDS = ('module', 'args', 'limit', 'username', 'become', 'become_method',
+                       'become_user', 'verbosity', 'sharded', 'shards')
+
+
+def build_schedule_payload(schedule):
+    """Resolve a schedule's saved playbook/inventory into a run payload."""
+    success, inventory = get_inventory_manager().get_inventory(schedule['inventory'])
+    if not success:
+        return False, f"Inventory {schedule['inventory']}: {inventory}"
+
+    payload = {k: schedule[k] for k in SCHEDULE_RUN_FIELDS if k in schedule}
+    payload['inventory'] = inventory
+
+    if schedule.get('playbook'):
+        success, content = read_playbook(schedule['playbook'])
+        if not success:
+            return False, f"Playbook {schedule['playbook']}: {content}"
+        payload['mode'] = 'playbook'
+        payload['playbook'] = content
+    else:
+        payload['mode'] = 'adhoc'
+    return True, payload
+
+
+@app.route('/schedules', methods=['GET'])
+def list_schedules():
+    """List all schedules."""
+    return jsonify({'schedules': get_schedule_manager().list_schedules(), 'leader': get_scheduler().is_leader})
+
+
+@app.route('/schedules/<name>', methods=['GET'])
+def get_schedule(name):
+    """Get a schedule by name."""
+    success, result = get_schedule_manager().get_schedule(name)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 404
+    return jsonify({'success': True, 'schedule': result})
+
+
+@app.route('/schedules', methods=['POST'])
+def save_schedule():
+    """Create or replace a schedule."""
+    data = request.get_json()
+    if not data:
+        return jsonify({'success': False, 'error': 'Invalid request data'}), 400
+
+    data = {k: v for k, v in data.items() if k not in ('password', 'become_password', 'last_fired')}
+    success, result = get_schedule_manager().save_schedule(data)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 400
+    return jsonify({'success': True, 'name': result})
+
+
+@app.route('/schedules/<name>', methods=['DELETE'])
+def delete_schedule(name):
+    """Delete a schedule."""
+    success, error = get_schedule_manager().delete_schedule(name)
+    if not success:
+        return jsonify({'success': False, 'error': error}), 404
+    return jsonify({'success': True})
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(
+                get_schedule_manager(), get_job_manager(), get_runner(), build_schedule_payload,
+                jitter=Config.SCHEDULE_JITTER, max_concurrent=Config.SCHEDULE_MAX_CONCURRENT,
+                # With the agent backend, scheduled jobs go straight to the agents
+                default_route=default_job_route()
+            )
+        return _scheduler
+
+
+def start_background_services():
+    """
+    Start per-process background threads. Called from gunicorn's
+    post_worker_init hook (threads don't survive the fork after a preload),
+    from __main__, and on the first request as a fallback.
+    """
+    if Config.SCHEDULER_ENABLED:
+        get_scheduler().start()
+
+
+@app.before_request
+def ensure_background_services():
+    start_background_services()
+
+def check_startup(budget_ms=None):
+    """
+    Measure the app's own import cost with python -X importtime in a fresh
+    interpreter (Flask itself excluded) and compare it with the budget.
+    Returns True when within budget.
+    """
+    import subprocess
+
+    budget_ms = budget_ms if budget_ms is not None else Config.STARTUP_BUDGET_MS
+    proc = subprocess.run(
+        # Flask is imported first so its dependencies aren't counted as ours
+        [sys.executable, '-X', 'importtime', '-c', 'import flask, app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        print(proc.stderr)
+        return False
+
+    # Lines look like: "import time:  self [us] | cumulative | <indent>name"
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            cumulative.setdefault(parts[2].strip(), int(parts[1]))
+
+    framework_ms = cumulative.get('flask', 0) / 1000
+    own_ms = cumulative.get('app', 0) / 1000
+    print(f"   Import time: Flask {framework_ms:.1f} ms, app {own_ms:.1f} ms (budget {budget_ms} ms)")
+    return own_ms <= budget_ms
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'check-startup':
+        sys.exit(0 if check_startup() else 1)
+
     print(f"🚀 Ekumen starting...")
     print(f"   Debug: {Config.DEBUG}")
     print(f"   Host: {Config.HOST}:{Config.PORT}")
+    start_background_services()
     app.run(debug=Config.DEBUG, host=Config.HOST, port=Config.PORT)
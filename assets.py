@@ -0,0 +1,187 @@
+"""
+Ekumen - Static Asset Pipeline
+Fingerprints static assets by content hash and serves them precompressed
+with immutable cache headers, so repeat page loads make no asset requests.
+
+Build step (run by the installers):
+    python assets.py build
+
+This writes static/dist/ with <name>.<hash>.<ext> files, .gz (and .br when
+the optional brotli package is installed) variants and a manifest.json.
+Without a build the app fingerprints and gzips assets in memory on startup.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+
+from flask import Response, abort, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_EXTENSIONS = ('.css', '.js')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+def _fingerprinted_name(logical, content):
+    """style.css -> style.<hash>.css"""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(logical)
+    return f'{stem}.{digest}{ext}'
+
+
+def _iter_assets(static_dir):
+    """Yield (logical_name, absolute_path) for every fingerprintable asset."""
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        dirnames[:] = [d for d in dirnames if d != 'dist']
+        for filename in sorted(filenames):
+            if filename.endswith(ASSET_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, static_dir).replace(os.sep, '/'), path
+
+
+def build(static_dir):
+    """Write fingerprinted, precompressed assets and a manifest to static/dist."""
+    import gzip
+
+    dist_dir = os.path.join(static_dir, 'dist')
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    manifest = {}
+    for logical, path in _iter_assets(static_dir):
+        with open(path, 'rb') as f:
+            content = f.read()
+        name = _fingerprinted_name(logical, content)
+        target = os.path.join(dist_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with open(target, 'wb') as f:
+            f.write(content)
+        with open(target + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9))
+        if brotli:
+            with open(target + '.br', 'wb') as f:
+                f.write(brotli.compress(content))
+        manifest[logical] = name
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetPipeline:
+    """Resolves logical asset names to fingerprinted URLs and serves them."""
+
+    def __init__(self, app):
+        self.static_dir = app.static_folder
+        self.dist_dir = os.path.join(self.static_dir, 'dist')
+        self.manifest = {}     # logical name -> fingerprinted name
+        self._sources = {}     # fingerprinted name -> source path (runtime fallback)
+        self._compressed = {}  # fingerprinted name -> gzip bytes (runtime fallback)
+        self._fingerprints = set()
+        self._lock = threading.Lock()
+        self.prebuilt = None  # Resolved on first use, not at import time
+
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    def _ensure_loaded(self):
+        """Load the build manifest, or fingerprint in memory, once per process."""
+        if self.prebuilt is not None:
+            return
+        with self._lock:
+            if self.prebuilt is not None:
+                return
+            prebuilt = self._load_manifest()
+            if not prebuilt:
+                self._fingerprint_in_memory()
+            self._fingerprints = set(self.manifest.values())
+            self.prebuilt = prebuilt
+
+    def _load_manifest(self):
+        """Use the build output if it exists and matches the current sources."""
+        try:
+            with open(os.path.join(self.dist_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        for logical, path in _iter_assets(self.static_dir):
+            if logical not in manifest or os.path.getmtime(path) > os.path.getmtime(
+                    os.path.join(self.dist_dir, manifest[logical])):
+                return False  # Stale build; fall back to runtime fingerprints
+        self.manifest = manifest
+        return True
+
+    def _fingerprint_in_memory(self):
+        for logical, path in _iter_assets(self.static_dir):
+            with open(path, 'rb') as f:
+                name = _fingerprinted_name(logical, f.read())
+            self.manifest[logical] = name
+            self._sources[name] = path
+
+    def url(self, logical):
+        """Template helper: fingerprinted URL, or the plain static URL if unknown."""
+        self._ensure_loaded()
+        name = self.manifest.get(logical)
+        if not name:
+            return url_for('static', filename=logical)
+        return url_for('asset', filename=name)
+
+    def _accepts(self, encoding):
+        return encoding in request.headers.get('Accept-Encoding', '')
+
+    def serve(self, filename):
+        """Serve a fingerprinted asset, precompressed when the client allows."""
+        self._ensure_loaded()
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        body, encoding = None, None
+
+        if self.prebuilt:
+            if filename not in self._fingerprints:
+                abort(404)
+            path = os.path.join(self.dist_dir, filename)
+            for enc, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if self._accepts(enc) and os.path.exists(path + suffix):
+                    path, encoding = path + suffix, enc
+                    break
+            with open(path, 'rb') as f:
+                body = f.read()
+        else:
+            source = self._sources.get(filename)
+            if not source:
+                abort(404)
+            if self._accepts('gzip'):
+                import gzip
+
+                with self._lock:
+                    if filename not in self._compressed:
+                        with open(source, 'rb') as f:
+                            self._compressed[filename] = gzip.compress(f.read(), compresslevel=9)
+                body, encoding = self._compressed[filename], 'gzip'
+            else:
+                with open(source, 'rb') as f:
+                    body = f.read()
+
+        response = Response(body, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE
+        response.headers['Vary'] = 'Accept-Encoding'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] != 'build':
+        print('Usage: python assets.py build')
+        sys.exit(1)
+    static = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    built = build(static)
+    print(f"✅ Built {len(built)} assets into {os.path.join(static, 'dist')}"
+          f"{'' if brotli else ' (gzip only, brotli not installed)'}")
@@ -0,0 +1,429 @@
+"""
+Ekumen - Execution Backends
+How a validated run is actually executed. AnsibleRunner builds the
+ansible/ansible-playbook command line and hands it to a backend:
+
+  auto       - subprocess for key-based runs, pexpect when passwords are
+               given (default)
+  pexpect    - PTY on this host, answers SSH/sudo password prompts
+  subprocess - plain pipes on this host, no PTY; key-based auth only
+  mock       - simulated ansible output for the inventory; no ansible needed
+  agent      - queues the whole run for remote worker agents and streams
+               their output back (not a command-line backend)
+
+Select one with ANSIBLE_SHUTTLE_BACKEND; new backends register themselves
+with @register_backend. Compare the local backends on a high-output command:
+
+    python backends.py benchmark [lines]
+"""
+
+import codecs
+import os
+import random
+import selectors
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+BACKENDS = {}
+
+# Bytes requested per read from a pipe
+READ_SIZE = 65536
+
+# Characters at the end of the PTY output searched for password prompts
+PROMPT_SEARCH_WINDOW = 2000
+
+
+def register_backend(name):
+    """Class decorator that makes a backend selectable by name."""
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def create_backend(name, **options):
+    """Instantiate a registered backend; raises ValueError for unknown names."""
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown execution backend "{name}". Available: {", ".join(sorted(BACKENDS))}')
+    return BACKENDS[name](**options)
+
+
+class Backend:
+    """
+    Base class. Local backends implement execute(); backends that run the
+    request elsewhere set local = False and implement dispatch().
+    """
+
+    name = None
+    local = True
+
+    def available(self):
+        """Whether this backend can run anything on this host."""
+        return shutil.which('ansible') is not None
+
+    def execute(self, cmd, password='', become_password=None, timeout=600, cwd=None, env=None, on_output=None):
+        """
+        Run one command line. If on_output is given it is called with each
+        chunk of output as it arrives. Returns (success, output, error).
+        """
+        raise NotImplementedError
+
+    def dispatch(self, data, on_output=None):
+        """Run a whole request elsewhere. Returns the runner result dict."""
+        raise NotImplementedError
+
+
+@register_backend('pexpect')
+class PexpectBackend(Backend):
+    """Runs ansible in a PTY so interactive password prompts can be answered."""
+
+    def execute(self, cmd, password='', become_password=None, timeout=600, cwd=None, env=None, on_output=None):
+        """Run a command in a PTY, answering SSH and sudo password prompts."""
+        import pexpect  # Imported on first run to keep worker boot fast
+
+        try:
+            # properly quote command for pexpect
+            cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
+            
+            # Spawn the process with a proper PTY
+            child = pexpect.spawn('/bin/bash', ['-c', cmd_str], timeout=timeout, cwd=cwd, env=env, encoding='utf-8')
+            
+            output_buffer = []
+            ssh_password_sent = False
+            become_password_sent = False
+            
+            # Patterns to match - order matters!
+            patterns = [
+                r'SSH password:',                    # 0: Ansible SSH password prompt
+                r'BECOME password',                  # 1: Ansible become password prompt  
+                r'(?i)password:',                    # 2: Generic password prompt
+                r'(?i)yes/no',                       # 3: Host key confirmation (yes/no)
+                r'\(yes/no/\[fingerprint\]\)',       # 4: Alternative host key prompt
+                r'Are you sure you want to continue', # 5: Another host key prompt variant
+                pexpect.EOF,                         # 6: End of output
+                pexpect.TIMEOUT                      # 7: Timeout
+            ]
+            
+            max_iterations = 30
+            iteration = 0
+            # A timeout doesn't consume child.before, so the next expect()
+            # returns it again; this many characters of it are already captured
+            delivered = 0
+            
+            while iteration < max_iterations:
+                iteration += 1
+                try:
+                    # Prompts arrive at the end of the output, so only the
+                    # tail is searched instead of everything since the last match
+                    index = child.expect(patterns, timeout=20, searchwindowsize=PROMPT_SEARCH_WINDOW)
+                    
+                    # Capture any output before the match
+                    new_output = child.before[delivered:] if child.before else ''
+                    delivered = len(child.before or '') if index == 7 else 0
+                    if new_output:
+                        output_buffer.append(new_output)
+                        if on_output:
+                            on_output(new_output)
+                    
+                    if index == 0:  # SSH password prompt
+                        child.sendline(password)
+                        ssh_password_sent = True
+                    elif index == 1:  # BECOME password prompt
+                        pwd_to_send = become_password if become_password else password
+                        child.sendline(pwd_to_send)
+                        become_password_sent = True
+                    elif index == 2:  # Generic password prompt
+                        # Determine which password to send based on what we've already sent
+                        if not ssh_password_sent:
+                            child.sendline(password)
+                            ssh_password_sent = True
+                        elif not become_password_sent:
+                            pwd_to_send = become_password if become_password else password
+                            child.sendline(pwd_to_send)
+                            become_password_sent = True
+                        else:
+                            # Already sent both, might be retrying
+                            child.sendline(password)
+                    elif index in [3, 4, 5]:  # Host key confirmation
+                        child.sendline('yes')
+                    elif index == 6:  # EOF - command finished
+                        break
+                    elif index == 7:  # Timeout
+                        # Check if process is still alive
+                        if not child.isalive():
+                            break
+                        continue
+                        
+                except pexpect.TIMEOUT:
+                    if not child.isalive():
+                        break
+                    continue
+                except pexpect.EOF:
+                    break
+            
+            # Wait for process to complete
+            child.close()
+            
+            # Get any remaining output
+            full_output = ''.join(str(x) for x in output_buffer if x)
+            
+            # Get exit status
+            success = child.exitstatus == 0 if child.exitstatus is not None else False
+            
+            return success, full_output, ''
+            
+        except pexpect.TIMEOUT:
+            return False, '', 'Command timed out'
+        except pexpect.EOF:
+            return False, '', 'Unexpected end of output'
+        except Exception as e:
+            return False, '', str(e)
+
+
+@register_backend('subprocess')
+class SubprocessBackend(Backend):
+    """
+    Runs ansible over plain pipes. There is no PTY, line discipline or
+    prompt matching, and stdout and stderr are read separately in large
+    chunks. It only works for key-based runs without SSH or become passwords.
+    """
+
+    def execute(self, cmd, password='', become_password=None, timeout=600, cwd=None, env=None, on_output=None):
+        if password or become_password:
+            return False, '', ('The subprocess backend does not support password authentication; '
+                               'use key-based auth or the pexpect backend.')
+
+        env = dict(env if env is not None else os.environ)
+        env['PYTHONUNBUFFERED'] = '1'  # Stream ansible's output instead of block-buffering it
+        try:
+            proc = subprocess.Popen(
+                cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
+            )
+        except OSError as e:
+            return False, '', str(e)
+
+        output_buffer, error_buffer = [], []
+        streams = {
+            proc.stdout.fileno(): (codecs.getincrementaldecoder('utf-8')(errors='replace'), output_buffer, on_output),
+            proc.stderr.fileno(): (codecs.getincrementaldecoder('utf-8')(errors='replace'), error_buffer, None),
+        }
+        deadline = time.monotonic() + timeout
+        timed_out = False
+
+        with selectors.DefaultSelector() as selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+            try:
+                while selector.get_map():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        timed_out = True
+                        os.killpg(proc.pid, signal.SIGKILL)
+                        break
+                    for key, _ in selector.select(remaining):
+                        chunk = os.read(key.fd, READ_SIZE)
+                        decoder, buffer, callback = streams[key.fd]
+                        text = decoder.decode(chunk, final=not chunk)
+                        if text:
+                            buffer.append(text)
+                            if callback:
+                                callback(text)
+                        if not chunk:
+                            selector.unregister(key.fd)
+            finally:
+                proc.stdout.close()
+                proc.stderr.close()
+                proc.wait()
+
+        output, error = ''.join(output_buffer), ''.join(error_buffer)
+        if timed_out:
+            return False, output, ('Command timed out\n' + error).strip()
+        return proc.returncode == 0, output, error
+
+
+@register_backend('auto')
+class AutoBackend(Backend):
+    """
+    Uses the subprocess fast path for key-based runs and pexpect only when
+    a password has to be typed into a prompt.
+    """
+
+    def __init__(self):
+        self.pty = PexpectBackend()
+        self.pipes = SubprocessBackend()
+
+    def execute(self, cmd, password='', become_password=None, timeout=600, cwd=None, env=None, on_output=None):
+        backend = self.pty if password or become_password else self.pipes
+        return backend.execute(cmd, password, become_password=become_password,
+                               timeout=timeout, cwd=cwd, env=env, on_output=on_output)
+
+
+@register_backend('mock')
+class MockBackend(Backend):
+    """
+    Produces ansible-like output for every host in the inventory without
+    running anything, so the full app can be load tested. Hosts whose names
+    start with 'fail' fail and 'unreachable' are unreachable.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay  # Seconds per host, to simulate real run times
+
+    def available(self):
+        return True
+
+    def _hosts(self, cmd):
+        from inventory_manager import match_hosts, merge_inventory_groups, parse_inventory_hosts
+
+        contents = []
+        for flag, value in zip(cmd, cmd[1:]):
+            if flag == '-i':
+                try:
+                    with open(value, 'r', encoding='utf-8') as f:
+                        contents.append(f.read())
+                except OSError:
+                    pass
+        hosts = list(dict.fromkeys(h for content in contents for h in parse_inventory_hosts(content)))
+        limit = dict(zip(cmd, cmd[1:])).get('--limit')
+        if limit and limit.startswith('@'):
+            try:
+                with open(limit[1:], 'r', encoding='utf-8') as f:
+                    limit = ','.join(line.strip() for line in f if line.strip())
+            except OSError:
+                limit = ''
+        if limit:
+            selected = match_hosts('all', merge_inventory_groups(contents), limit)
+            hosts = [h for h in hosts if h in selected]
+        return hosts
+
+    def _host_output(self, cmd, host):
+        status = 'UNREACHABLE' if host.startswith('unreachable') else 'FAILED' if host.startswith('fail') else 'ok'
+        if cmd[0] == 'ansible-playbook':
+            if status == 'ok':
+                return f'ok: [{host}]\nchanged: [{host}]\n', status
+            return f'fatal: [{host}]: {status}! => {{"msg": "Simulated failure"}}\n', status
+
+        module = cmd[cmd.index('-m') + 1] if '-m' in cmd else 'command'
+        if status != 'ok':
+            return f'{host} | {status}! => {{\n    "changed": false,\n    "msg": "Simulated failure"\n}}\n', status
+        if module == 'ping':
+            return f'{host} | SUCCESS => {{\n    "changed": false,\n    "ping": "pong"\n}}\n', status
+        return f'{host} | CHANGED | rc=0 >>\nSimulated {module} on {host}\n', status
+
+    def execute(self, cmd, password='', become_password=None, timeout=600, cwd=None, env=None, on_output=None):
+        output_buffer = []
+
+        def emit(text):
+            output_buffer.append(text)
+            if on_output:
+                on_output(text)
+
+        playbook = cmd[0] == 'ansible-playbook'
+        if playbook:
+            emit('\nPLAY [Simulated play] ' + '*' * 58 + '\n\nTASK [Simulated task] ' + '*' * 58 + '\n')
+
+        statuses = {}
+        for host in self._hosts(cmd):
+            if self.delay:
+                time.sleep(random.uniform(0.5, 1.5) * self.delay)
+            text, statuses[host] = self._host_output(cmd, host)
+            emit(text)
+
+        if playbook:
+            from output_parser import format_recap
+
+            recap = {
+                host: {'ok': 2 if s == 'ok' else 0, 'changed': 1 if s == 'ok' else 0,
+                       'unreachable': int(s == 'UNREACHABLE'), 'failed': int(s == 'FAILED')}
+                for host, s in statuses.items()
+            }
+            emit('\n' + format_recap(recap) + '\n')
+
+        return all(s == 'ok' for s in statuses.values()), ''.join(output_buffer), ''
+
+
+@register_backend('agent')
+class AgentBackend(Backend):
+    """
+    Queues each run as a job for remote worker agents (see agent.py) and
+    waits for it, streaming the agent's output back as it arrives.
+    """
+
+    local = False
+
+    def __init__(self, job_manager, route=None, timeout=600, poll_interval=0.5):
+        self.job_manager = job_manager
+        self.route = route
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def available(self):
+        return True  # Ansible only has to be installed on the agents
+
+    def dispatch(self, data, on_output=None):
+        success, job_id = self.job_manager.create_job(data, route=self.route, source='backend')
+        if not success:
+            return {'success': False, 'output': '', 'error': job_id}
+
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        output_buffer = []
+        offset = 0
+        deadline = time.time() + self.timeout
+        while True:
+            found, job = self.job_manager.get_job(job_id)
+            chunk = self.job_manager.read_output_bytes(job_id, offset)
+            offset += len(chunk)
+            finished = not found or job['status'] in ('completed', 'failed')
+            text = decoder.decode(chunk, final=finished)
+            if text:
+                output_buffer.append(text)
+                if on_output:
+                    on_output(text)
+
+            if not found:
+                return {'success': False, 'output': ''.join(output_buffer), 'error': job, 'job_id': job_id}
+            if finished:
+                return {'success': bool(job['success']), 'output': ''.join(output_buffer),
+                        'error': job.get('error', ''), 'job_id': job_id}
+            if time.time() > deadline:
+                # The caller is told the run failed, so no agent may start it later
+                error = f'Timed out waiting for job {job_id} ({job["status"]})'
+                self.job_manager.cancel_job(job_id, reason=error)
+                return {'success': False, 'output': ''.join(output_buffer), 'error': error, 'job_id': job_id}
+            time.sleep(self.poll_interval)
+
+
+def benchmark(lines=200000):
+    """
+    Run a synthetic high-output command through the local backends.
+    Returns {name: (wall_seconds, cpu_seconds_in_this_process, output_chars)}.
+    """
+    script = (
+        "import sys\n"
+        "line = '%s | CHANGED | rc=0 >> ' + 'x' * 80 + '\\n'\n"
+        f"sys.stdout.writelines(line % ('host%05d' % (i % 400)) for i in range({lines}))\n"
+    )
+    cmd = [sys.executable, '-c', script]
+    results = {}
+    for name in ('pexpect', 'subprocess'):
+        backend = create_backend(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        success, output, error = backend.execute(cmd, timeout=600, on_output=lambda text: None)
+        results[name] = (time.perf_counter() - wall, time.process_time() - cpu, len(output))
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'benchmark':
+        print('Usage: python backends.py benchmark [lines]')
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else 200000
+    print(f'{count} lines of output:')
+    for name, (wall, cpu, chars) in benchmark(count).items():
+        print(f'   {name:<11} {wall:6.2f} s wall  {cpu:6.2f} s CPU  {chars} chars')
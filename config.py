@@ -15,12 +15,49 @@ class Config:
     HOST = os.environ.get('ANSIBLE_SHUTTLE_HOST', '0.0.0.0')
     PORT = int(os.environ.get('ANSIBLE_SHUTTLE_PORT', 5000))
     
+    # Import-time budget for the app's own modules, checked by `python app.py check-startup`
+    STARTUP_BUDGET_MS = int(os.environ.get('ANSIBLE_SHUTTLE_STARTUP_BUDGET_MS', 100))
+
     # Security settings
     SECRET_KEY = os.environ.get('ANSIBLE_SHUTTLE_SECRET_KEY', os.urandom(24).hex())
     
     # Ansible settings
     COMMAND_TIMEOUT = int(os.environ.get('ANSIBLE_SHUTTLE_TIMEOUT', 600))
     SSH_CONNECT_TIMEOUT = int(os.environ.get('ANSIBLE_SHUTTLE_SSH_TIMEOUT', 10))
+
+    # Execution backend: auto (subprocess unless passwords are given), pexpect,
+    # subprocess (key-based auth only), mock or agent
+    EXECUTION_BACKEND = os.environ.get('ANSIBLE_SHUTTLE_BACKEND', 'auto').lower()
+    # Agent group that runs go to with the agent backend (empty = any agent)
+    BACKEND_ROUTE = os.environ.get('ANSIBLE_SHUTTLE_BACKEND_ROUTE', '')
+    # Seconds per host the mock backend waits, to simulate real runs
+    MOCK_DELAY = float(os.environ.get('ANSIBLE_SHUTTLE_MOCK_DELAY', 0))
+
+    # Result cache for read-only ad-hoc modules (opt-in per request with "cache": true)
+    CACHEABLE_MODULES = os.environ.get('ANSIBLE_SHUTTLE_CACHE_MODULES', 'ping,setup,stat').split(',')
+    CACHEABLE_MODULES = [m.strip() for m in CACHEABLE_MODULES if m.strip()]
+    CACHE_TTL = int(os.environ.get('ANSIBLE_SHUTTLE_CACHE_TTL', 10))
+    CACHE_MAX_TTL = int(os.environ.get('ANSIBLE_SHUTTLE_CACHE_MAX_TTL', 300))
+    # Shared by the gunicorn workers so identical requests run once in total (empty = per worker)
+    CACHE_DIR = os.environ.get('ANSIBLE_SHUTTLE_CACHE_DIR', '/opt/ekumen/cache')
+
+    # Per-caller limits on /run, /run/batch and queued jobs, shared by all workers (0 = no limit)
+    RATE_LIMIT_DIR = os.environ.get('ANSIBLE_SHUTTLE_RATE_LIMIT_DIR', '/opt/ekumen/ratelimits')
+    RATE_LIMIT_RUNS_PER_MINUTE = int(os.environ.get('ANSIBLE_SHUTTLE_RATE_LIMIT_RUNS', 30))
+    RATE_LIMIT_CONCURRENT = int(os.environ.get('ANSIBLE_SHUTTLE_RATE_LIMIT_CONCURRENT', 4))
+    RATE_LIMIT_HOSTS_PER_HOUR = int(os.environ.get('ANSIBLE_SHUTTLE_RATE_LIMIT_HOSTS', 0))
+    # Header set by an authenticating reverse proxy to identify the user
+    # (empty = limit by client IP)
+    RATE_LIMIT_USER_HEADER = os.environ.get('ANSIBLE_SHUTTLE_RATE_LIMIT_USER_HEADER', '')
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted
+    # for the client IP (0 = use the connecting address)
+    TRUSTED_PROXIES = int(os.environ.get('ANSIBLE_SHUTTLE_TRUSTED_PROXIES', 0))
+
+    # Upper bound on --forks for /run/batch
+    BATCH_MAX_FORKS = int(os.environ.get('ANSIBLE_SHUTTLE_BATCH_MAX_FORKS', 50))
+
+    # Default number of parallel shards for sharded runs (0 = CPU count)
+    SHARD_COUNT = int(os.environ.get('ANSIBLE_SHUTTLE_SHARDS', 0))
     
     # Allowed modules (empty list = all allowed)
     ALLOWED_MODULES = os.environ.get('ANSIBLE_SHUTTLE_ALLOWED_MODULES', '').split(',')
@@ -31,3 +68,21 @@ class Config:
 
     # Inventory Library
     INVENTORY_DIR = os.environ.get('ANSIBLE_SHUTTLE_INVENTORY_DIR', '/opt/ekumen/inventories')
+
+    # Job queue (shared by gunicorn workers and remote agents)
+    JOB_DIR = os.environ.get('ANSIBLE_SHUTTLE_JOB_DIR', '/opt/ekumen/jobs')
+
+    # Per-host index of run results and facts (SQLite)
+    HOST_INDEX_PATH = os.environ.get('ANSIBLE_SHUTTLE_HOST_INDEX', '/opt/ekumen/hosts.db')
+    HOST_INDEX_RETENTION_DAYS = int(os.environ.get('ANSIBLE_SHUTTLE_HOST_INDEX_RETENTION_DAYS', 30))
+
+    # Scheduled runs - one gunicorn worker is elected to enqueue them
+    SCHEDULE_DIR = os.environ.get('ANSIBLE_SHUTTLE_SCHEDULE_DIR', '/opt/ekumen/schedules')
+    SCHEDULER_ENABLED = os.environ.get('ANSIBLE_SHUTTLE_SCHEDULER', 'true').lower() == 'true'
+    SCHEDULE_JITTER = int(os.environ.get('ANSIBLE_SHUTTLE_SCHEDULE_JITTER', 60))
+    SCHEDULE_MAX_CONCURRENT = int(os.environ.get('ANSIBLE_SHUTTLE_SCHEDULE_MAX_CONCURRENT', 4))
+
+    # Worker agents - shared token required on agent endpoints (empty = localhost only)
+    AGENT_TOKEN = os.environ.get('ANSIBLE_SHUTTLE_AGENT_TOKEN', '')
+    AGENT_TIMEOUT = int(os.environ.get('ANSIBLE_SHUTTLE_AGENT_TIMEOUT', 60))
+    AGENT_POLL_INTERVAL = float(os.environ.get('ANSIBLE_SHUTTLE_AGENT_POLL_INTERVAL', 2))
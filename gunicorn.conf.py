@@ -0,0 +1,46 @@
+"""
+Ekumen - Gunicorn Configuration
+Selects the worker profile used in production deployments.
+
+Worker modes (ANSIBLE_SHUTTLE_WORKER_MODE):
+  sync    - one request per worker process (original behaviour)
+  gthread - a thread pool per worker; open runs no longer pin a process
+  gevent  - cooperative greenlets; pexpect reads yield to other connections
+"""
+
+import os
+
+worker_mode = os.environ.get('ANSIBLE_SHUTTLE_WORKER_MODE', 'gthread').lower()
+
+bind = f"{os.environ.get('ANSIBLE_SHUTTLE_HOST', '0.0.0.0')}:{os.environ.get('ANSIBLE_SHUTTLE_PORT', '5000')}"
+workers = int(os.environ.get('ANSIBLE_SHUTTLE_WORKERS', 3))
+
+if worker_mode == 'gevent':
+    try:
+        import gevent  # noqa: F401
+        worker_class = 'gevent'
+        worker_connections = int(os.environ.get('ANSIBLE_SHUTTLE_WORKER_CONNECTIONS', 1000))
+    except ImportError:
+        # gevent is an optional dependency; fall back to threads
+        worker_mode = 'gthread'
+
+if worker_mode == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('ANSIBLE_SHUTTLE_THREADS', 32))
+elif worker_mode != 'gevent':
+    worker_class = 'sync'
+
+# Runs block their request for up to the command timeout (10 minutes),
+# so the worker timeout must be longer than that for sync workers.
+timeout = int(os.environ.get('ANSIBLE_SHUTTLE_WORKER_TIMEOUT', 660))
+graceful_timeout = 30
+
+# Import the app once in the master and fork workers from it, so restarts
+# and rolling deploys don't re-import everything in every worker.
+preload_app = os.environ.get('ANSIBLE_SHUTTLE_PRELOAD', 'false').lower() == 'true'
+
+
+def post_worker_init(worker):
+    """Start background threads in each worker (they don't survive the fork)."""
+    from app import start_background_services
+    start_background_services()
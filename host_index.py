@@ -0,0 +1,267 @@
+"""
+Ekumen - Host Index
+Per-host index of run results and gathered facts, fed incrementally as runs
+finish, so fleet-wide questions ("which hosts failed ping in the last hour",
+"which hosts run kernel X") are answered without re-running anything.
+
+Runs are indexed by a background thread per process (record_later), so
+requests do not wait on parsing and SQLite writes.
+
+Stored in SQLite (WAL mode), shared by all gunicorn workers:
+    hosts    last status, module and job per host, plus the last facts
+    results  one row per host per run, pruned after the retention period
+    facts    flattened facts (name -> value) per host, for filtering
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from output_parser import parse_recap, split_adhoc_output, split_host_output
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY, status TEXT, module TEXT, last_job TEXT, last_seen REAL,
+    facts TEXT, facts_job TEXT, facts_updated REAL
+);
+CREATE TABLE IF NOT EXISTS results (host TEXT, job_id TEXT, status TEXT, module TEXT, finished REAL);
+CREATE INDEX IF NOT EXISTS results_by_time ON results (finished);
+CREATE INDEX IF NOT EXISTS results_by_host ON results (host, finished);
+CREATE TABLE IF NOT EXISTS facts (host TEXT, name TEXT, value TEXT, PRIMARY KEY (host, name)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS facts_by_value ON facts (name, value);
+'''
+
+ADHOC_STATUSES = {'SUCCESS': 'ok', 'CHANGED': 'changed', 'FAILED': 'failed',
+                  'UNREACHABLE': 'unreachable', 'SKIPPED': 'skipped'}
+
+# Nested fact dicts are flattened to dotted names up to this depth
+FACT_DEPTH = 2
+
+
+def _flatten_facts(facts, prefix='', depth=0):
+    """{'a': {'b': 1}, 'c': ['x', 'y']} -> {'a.b': '1', 'c': 'x,y'}; other lists are skipped."""
+    flat = {}
+    for name, value in facts.items():
+        key = prefix + name
+        if isinstance(value, dict):
+            if depth + 1 < FACT_DEPTH:
+                flat.update(_flatten_facts(value, key + '.', depth + 1))
+        elif isinstance(value, list):
+            if all(isinstance(v, (str, int, float, bool)) for v in value):
+                flat[key] = ','.join(str(v) for v in value)
+        elif value is not None:
+            flat[key] = str(value)
+    return flat
+
+
+def _json_result(lines):
+    """The first '=> {...}' JSON result in a host's output lines, or None."""
+    for i, line in enumerate(lines):
+        if '=> {' not in line:
+            continue
+        text = '{' + line.split('=> {', 1)[1]
+        if not text.rstrip().endswith('}'):
+            end = next((j for j in range(i + 1, len(lines)) if lines[j] == '}'), None)
+            if end is None:
+                continue
+            text = '\n'.join([text] + lines[i + 1:end + 1])
+        try:
+            return json.loads(text)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_host_results(output):
+    """
+    Read per-host status and gathered facts from run output.
+    Returns {host: {'status': ..., 'facts': dict_or_None}}.
+    """
+    results = {}
+    adhoc = split_adhoc_output(output)
+    if adhoc:
+        for host, section in adhoc.items():
+            parsed = _json_result(section['output'].splitlines())
+            facts = parsed.get('ansible_facts') if isinstance(parsed, dict) else None
+            results[host] = {'status': ADHOC_STATUSES.get(section['status'], 'ok'), 'facts': facts}
+        return results
+
+    host_lines = split_host_output(output)
+    for host, host_stats in parse_recap(output).items():
+        if host_stats.get('unreachable'):
+            status = 'unreachable'
+        elif host_stats.get('failed'):
+            status = 'failed'
+        elif host_stats.get('changed'):
+            status = 'changed'
+        elif host_stats.get('ok'):
+            status = 'ok'
+        else:
+            status = 'skipped'
+        parsed = _json_result(host_lines.get(host, []))
+        facts = parsed.get('ansible_facts') if isinstance(parsed, dict) else None
+        results[host] = {'status': status, 'facts': facts}
+    return results
+
+
+class HostIndex:
+    """SQLite-backed index of the last known state of every host."""
+
+    def __init__(self, db_path, retention_days=30):
+        self.db_path = db_path
+        self.retention = retention_days * 86400
+        self._local = threading.local()
+        self._queue = None
+        self._queue_lock = threading.Lock()
+
+    def _connect(self):
+        """One connection per thread; the schema is created on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3  # Imported on first use to keep worker boot fast
+
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def record(self, output, job_id=None, module=None, finished=None):
+        """
+        Index the per-host results of one finished run.
+        Returns (success, hosts_indexed_or_error).
+        """
+        results = parse_host_results(output)
+        if not results:
+            return True, 0
+        finished = finished or time.time()
+
+        import sqlite3
+
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT INTO results (host, job_id, status, module, finished) VALUES (?, ?, ?, ?, ?)',
+                    [(host, job_id, r['status'], module, finished) for host, r in results.items()]
+                )
+                conn.executemany(
+                    '''INSERT INTO hosts (host, status, module, last_job, last_seen) VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT(host) DO UPDATE SET status = excluded.status, module = excluded.module,
+                       last_job = excluded.last_job, last_seen = excluded.last_seen''',
+                    [(host, r['status'], module, job_id, finished) for host, r in results.items()]
+                )
+                for host, r in results.items():
+                    if not r['facts']:
+                        continue
+                    conn.execute('UPDATE hosts SET facts = ?, facts_job = ?, facts_updated = ? WHERE host = ?',
+                                 (json.dumps(r['facts']), job_id, finished, host))
+                    # Only write facts that changed since the host was last indexed
+                    new = _flatten_facts(r['facts'])
+                    old = dict(conn.execute('SELECT name, value FROM facts WHERE host = ?', (host,)))
+                    conn.executemany('DELETE FROM facts WHERE host = ? AND name = ?',
+                                     [(host, name) for name in old if name not in new])
+                    conn.executemany('INSERT OR REPLACE INTO facts (host, name, value) VALUES (?, ?, ?)',
+                                     [(host, name, value) for name, value in new.items() if old.get(name) != value])
+                conn.execute('DELETE FROM results WHERE finished < ?', (finished - self.retention,))
+            return True, len(results)
+        except (sqlite3.Error, OSError) as e:
+            return False, str(e)
+
+    def record_later(self, output, job_id=None, module=None, finished=None):
+        """Queue a finished run for record() on the background indexing thread."""
+        with self._queue_lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                threading.Thread(target=self._index_pending, name='host-index', daemon=True).start()
+                atexit.register(self.flush)
+        self._queue.put((output, job_id, module, finished or time.time()))
+
+    def _index_pending(self):
+        while True:
+            output, job_id, module, finished = self._queue.get()
+            try:
+                success, error = self.record(output, job_id=job_id, module=module, finished=finished)
+                if not success:
+                    print(f"   Host index error: {error}")
+            except Exception as e:  # Keep indexing later runs
+                print(f"   Host index error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=10):
+        """Wait (up to timeout seconds) for queued runs to be indexed. Returns True when none are left."""
+        if self._queue is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._queue.unfinished_tasks
+
+    def query(self, status=None, module=None, since=None, facts=None, host=None, limit=500):
+        """
+        Find hosts. With module or since, status is matched against results
+        in that window; otherwise against each host's last status.
+        facts is a list of (name, glob) pairs; host is a glob on the name.
+        Returns (success, [host records] or error).
+        """
+        import sqlite3
+
+        where, params = [], []
+        if module or since:
+            conditions, sub_params = [], []
+            if status:
+                conditions.append('r.status = ?')
+                sub_params.append(status)
+            if module:
+                conditions.append('r.module = ?')
+                sub_params.append(module)
+            if since:
+                conditions.append('r.finished >= ?')
+                sub_params.append(time.time() - float(since))
+            where.append('EXISTS (SELECT 1 FROM results r WHERE r.host = h.host AND ' + ' AND '.join(conditions) + ')')
+            params.extend(sub_params)
+        elif status:
+            where.append('h.status = ?')
+            params.append(status)
+        for name, pattern in facts or []:
+            where.append('EXISTS (SELECT 1 FROM facts f WHERE f.host = h.host AND f.name = ? AND f.value GLOB ?)')
+            params.extend([name, pattern])
+        if host:
+            where.append('h.host GLOB ?')
+            params.append(host)
+
+        sql = 'SELECT host, status, module, last_job, last_seen, facts_job, facts_updated FROM hosts h'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY h.host LIMIT ?'
+        params.append(int(limit))
+        try:
+            return True, [dict(row) for row in self._connect().execute(sql, params)]
+        except (sqlite3.Error, OSError) as e:
+            return False, str(e)
+
+    def get_host(self, host, history=20):
+        """A host's record with its last facts and recent results. Returns (success, record_or_error)."""
+        import sqlite3
+
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT * FROM hosts WHERE host = ?', (host,)).fetchone()
+            if not row:
+                return False, 'Host not found'
+            record = dict(row)
+            record['facts'] = json.loads(record['facts']) if record['facts'] else None
+            record['results'] = [dict(r) for r in conn.execute(
+                'SELECT job_id, status, module, finished FROM results WHERE host = ? ORDER BY finished DESC LIMIT ?',
+                (host, history)
+            )]
+            return True, record
+        except (sqlite3.Error, OSError) as e:
+            return False, str(e)
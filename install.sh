@@ -7,6 +7,8 @@ set -e
 # Default settings
 INSTALL_DIR="${EKUMEN_INSTALL_DIR:-/opt/ekumen}"
 SERVICE_NAME="ekumen"
+# Worker profile: gthread (default), gevent or sync
+WORKER_MODE="${EKUMEN_WORKER_MODE:-gthread}"
 USER_NAME="${SUDO_USER:-$USER}"
 GROUP_NAME=$(id -gn "$USER_NAME")
 
@@ -35,6 +37,12 @@ source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
 pip install gunicorn
+if [ "$WORKER_MODE" = "gevent" ]; then
+    pip install gevent
+fi
+
+# Fingerprint and precompress static assets
+python assets.py build || echo "Asset build failed, assets will be fingerprinted at startup"
 
 # Set ownership
 chown -R "$USER_NAME:$GROUP_NAME" "$INSTALL_DIR"
@@ -54,7 +62,8 @@ WorkingDirectory=$INSTALL_DIR
 Environment="PATH=$INSTALL_DIR/venv/bin:/usr/bin"
 Environment="ANSIBLE_SHUTTLE_HOST=0.0.0.0"
 Environment="ANSIBLE_SHUTTLE_PORT=5000"
-ExecStart=$INSTALL_DIR/venv/bin/gunicorn --workers 3 --bind 0.0.0.0:5000 app:app
+Environment="ANSIBLE_SHUTTLE_WORKER_MODE=$WORKER_MODE"
+ExecStart=$INSTALL_DIR/venv/bin/gunicorn --config $INSTALL_DIR/gunicorn.conf.py app:app
 Restart=always
 
 [Install]
@@ -75,4 +84,5 @@ echo "  sudo systemctl status $SERVICE_NAME"
 echo "  sudo systemctl restart $SERVICE_NAME"
 echo "  sudo systemctl stop $SERVICE_NAME"
 echo ""
+echo "Worker mode: $WORKER_MODE"
 echo "Access the interface at http://<server-ip>:5000"
@@ -6,13 +6,154 @@ Handles storage and retrieval of Ansible inventory files.
 import os
 import re
 
+from inventory_validator import is_yaml_inventory, parse_yaml_groups, parse_yaml_hosts
+from storage import VersionedStore
+
+HOST_RANGE_RE = re.compile(r'\[(\d+):(\d+)\]')
+
+
+def _expand_host_range(pattern):
+    """Expand a numeric host range such as web[01:03] into individual hosts."""
+    match = HOST_RANGE_RE.search(pattern)
+    if not match:
+        return [pattern]
+
+    start, end = match.group(1), match.group(2)
+    width = len(start) if start.startswith('0') else 0
+    hosts = []
+    for i in range(int(start), int(end) + 1):
+        expanded = pattern[:match.start()] + str(i).zfill(width) + pattern[match.end():]
+        hosts.extend(_expand_host_range(expanded))
+    return hosts
+
+
+def parse_inventory_hosts(content):
+    """
+    Return the unique host names of an inventory, in file order.
+    In INI inventories, group variable and children sections are skipped.
+    """
+    if is_yaml_inventory(content):
+        return parse_yaml_hosts(content)
+
+    hosts = []
+    seen = set()
+    in_host_section = True
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('['):
+            section = line.strip('[]')
+            in_host_section = not section.endswith((':vars', ':children'))
+            continue
+        if not in_host_section:
+            continue
+        for host in _expand_host_range(line.split()[0]):
+            if host not in seen:
+                seen.add(host)
+                hosts.append(host)
+    return hosts
+
+
+def parse_inventory_groups(content):
+    """
+    Return {group: set(hosts)} for an inventory, with child groups resolved.
+    Hosts outside any group are in 'ungrouped'; 'all' holds every host.
+    """
+    if is_yaml_inventory(content):
+        direct, children = parse_yaml_groups(content)
+    else:
+        direct, children = {'ungrouped': []}, {}
+        group, kind = 'ungrouped', None
+        for line in content.splitlines():
+            line = line.strip()
+            if not line or line.startswith(('#', ';')):
+                continue
+            if line.startswith('['):
+                group, _, kind = line.strip('[]').partition(':')
+                if kind != 'vars':
+                    direct.setdefault(group, [])
+                    children.setdefault(group, [])
+                continue
+            if kind == 'children':
+                children[group].append(line.split()[0])
+            elif not kind:
+                direct[group].extend(_expand_host_range(line.split()[0]))
+
+    resolved = {}
+
+    def resolve(name, seen):
+        if name in resolved:
+            return resolved[name]
+        hosts = set(direct.get(name, []))
+        for child in children.get(name, []):
+            if child not in seen:
+                hosts |= resolve(child, seen | {child})
+        resolved[name] = hosts
+        return hosts
+
+    for name in set(direct) | set(children):
+        resolve(name, {name})
+    resolved['all'] = set(parse_inventory_hosts(content))
+    return resolved
+
+
+def match_hosts(pattern, groups, limit=None):
+    """
+    Hosts matched by an Ansible host pattern: groups, hosts, '*' wildcards,
+    ':'/',' unions, '&' intersections and '!' exclusions.
+    """
+    all_hosts = groups.get('all', set())
+
+    def expand(term):
+        if term in ('all', '*'):
+            return set(all_hosts)
+        if term in groups:
+            return set(groups[term])
+        if '*' in term:
+            regex = re.compile('^' + re.escape(term).replace(r'\*', '.*') + '$')
+            matched = {h for h in all_hosts if regex.match(h)}
+            for name, members in groups.items():
+                if regex.match(name):
+                    matched |= members
+            return matched
+        return {term} & all_hosts
+
+    def select(expression):
+        terms = [t.strip() for t in re.split(r'[,:]', expression) if t.strip()]
+        selected = set()
+        for term in (t for t in terms if t[0] not in '!&'):
+            selected |= expand(term)
+        for term in (t for t in terms if t[0] == '&'):
+            selected &= expand(term[1:])
+        for term in (t for t in terms if t[0] == '!'):
+            selected -= expand(term[1:])
+        return selected
+
+    hosts = select(pattern) if pattern else set()
+    if limit:
+        hosts &= select(limit)
+    return hosts
+
+
+def merge_inventory_groups(contents):
+    """
+    Groups of several inventories used together (one -i each), as
+    parse_inventory_groups returns them: same-named groups are merged.
+    """
+    groups = {}
+    for content in contents:
+        for name, hosts in parse_inventory_groups(content).items():
+            groups.setdefault(name, set()).update(hosts)
+    return groups
+
 
 class InventoryManager:
     """Manages saved Ansible inventories."""
 
     def __init__(self, inventory_dir):
         self.inventory_dir = inventory_dir
-        self._ensure_dir()
+        self.store = VersionedStore(inventory_dir)
 
     def _ensure_dir(self):
         """Create inventory directory if it doesn't exist."""
@@ -63,14 +204,23 @@ class InventoryManager:
         """Save an inventory. Returns (success, name_or_error)."""
         self._ensure_dir()
         safe_name = self._sanitize_name(name)
-        path = os.path.join(self.inventory_dir, safe_name)
 
-        try:
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            return True, safe_name
-        except Exception as e:
-            return False, str(e)
+        success, result = self.store.write(safe_name, content)
+        if not success:
+            return False, result
+        return True, safe_name
+
+    def list_versions(self, name):
+        """List saved versions of an inventory, oldest first."""
+        return self.store.versions(self._sanitize_name(name))
+
+    def get_version(self, name, version):
+        """Get one version of an inventory. Returns (success, content_or_error)."""
+        return self.store.read_version(self._sanitize_name(name), version)
+
+    def diff_versions(self, name, from_version=None, to_version=None):
+        """Diff two versions of an inventory. Returns (success, diff_or_error)."""
+        return self.store.diff(self._sanitize_name(name), from_version, to_version)
 
     def delete_inventory(self, name):
         """Delete an inventory. Returns (success, error_or_none)."""
@@ -0,0 +1,306 @@
+"""
+Ekumen - Inventory Validator
+Single-pass validation of INI and YAML inventories. Every problem is
+reported with its line number, and results are memoised by content hash so
+re-running a saved inventory doesn't validate it again. Time it on
+generated inventories with:
+
+    python inventory_validator.py benchmark [hosts]
+"""
+
+import hashlib
+import re
+import shlex
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+HOST_PATTERN = r'[\w.\-@:\[\]]+'
+VAR_PATTERN = r'[\w.]+=(?:"[^"\\]*"|\'[^\'\\]*\'|[^\s"\'\\]*)'
+
+SECTION_RE = re.compile(r'^\[([^\]]*)\]\s*(?:[#;].*)?$')
+SECTION_NAME_RE = re.compile(r'^[\w\-.]+(?::(vars|children))?$')
+HOST_LINE_RE = re.compile(rf'^({HOST_PATTERN})((?:\s+{VAR_PATTERN})*)\s*(?:[#;].*)?$')
+HOST_NAME_RE = re.compile(rf'^{HOST_PATTERN}$')
+VAR_NAME_RE = re.compile(r'^[\w.]+$')
+VAR_LINE_RE = re.compile(r'^[\w.]+\s*=.*$')
+CHILD_LINE_RE = re.compile(r'^[\w\-.]+\s*(?:[#;].*)?$')
+YAML_START_RE = re.compile(r'^(?:---|[\w\-.]+:\s*(?:#.*)?$)')
+
+YAML_GROUP_KEYS = ('hosts', 'vars', 'children')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 128
+
+_yaml = None
+
+
+def get_yaml():
+    """Import PyYAML on first use; returns None if it isn't installed."""
+    global _yaml
+    if _yaml is None:
+        try:
+            import yaml
+            _yaml = yaml
+        except ImportError:
+            _yaml = False
+    return _yaml or None
+
+
+def yaml_loader(yaml):
+    """The libyaml-backed loader when available; it is roughly 10x faster."""
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def is_yaml_inventory(content):
+    """Guess whether an inventory is YAML (first meaningful line is '---' or 'group:')."""
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith(('#', ';')):
+            return bool(YAML_START_RE.match(stripped)) and not stripped.startswith('[')
+    return False
+
+
+def _validate_ini(content):
+    errors = []
+    section_kind = None  # None = hosts, 'vars' or 'children'
+    for line_no, raw in enumerate(content.splitlines(), 1):
+        line = raw.strip()
+        if not line or line[0] in '#;':
+            continue
+
+        if line[0] == '[':
+            match = SECTION_RE.match(line)
+            name_match = SECTION_NAME_RE.match(match.group(1)) if match else None
+            if not name_match:
+                errors.append((line_no, f'Invalid section header: {line}'))
+                section_kind = None
+                continue
+            section_kind = name_match.group(1)
+            continue
+
+        if section_kind == 'vars':
+            if not VAR_LINE_RE.match(line):
+                errors.append((line_no, f'Expected key=value in vars section: {line}'))
+        elif section_kind == 'children':
+            if not CHILD_LINE_RE.match(line):
+                errors.append((line_no, f'Invalid child group name: {line}'))
+        elif not HOST_LINE_RE.match(line):
+            error = _host_line_error(line)
+            if error:
+                errors.append((line_no, error))
+    return errors
+
+
+def _host_line_error(line):
+    """
+    Check a host line the fast pattern didn't accept (escaped or nested
+    quotes) the way Ansible's INI parser reads it: shell-style tokens, a
+    host name, then key=value pairs. Returns an error message or None.
+    """
+    host = line.split()[0]
+    if not HOST_NAME_RE.match(host):
+        return f'Invalid host format: {host}'
+    try:
+        tokens = shlex.split(line, comments=True)
+    except ValueError:
+        return f'Invalid host variables: {line}'
+    for token in tokens[1:]:
+        name, sep, _ = token.partition('=')
+        if not sep or not VAR_NAME_RE.match(name):
+            return f'Invalid host variables: {line}'
+    return None
+
+
+def _yaml_host_nodes(node):
+    """Yield the key node of every host under a YAML inventory group tree."""
+    yaml = get_yaml()
+    if not isinstance(node, yaml.MappingNode):
+        return
+    for key, value in node.value:
+        if key.value == 'hosts' and isinstance(value, yaml.MappingNode):
+            for host_key, _ in value.value:
+                yield host_key
+        elif key.value == 'children' and isinstance(value, yaml.MappingNode):
+            for _, child in value.value:
+                yield from _yaml_host_nodes(child)
+
+
+def _validate_yaml_group(name_node, node, errors):
+    yaml = get_yaml()
+    if isinstance(node, yaml.ScalarNode) and node.value in ('', '~', 'null'):
+        return  # An empty group is allowed
+    if not isinstance(node, yaml.MappingNode):
+        errors.append((name_node.start_mark.line + 1, f'Group "{name_node.value}" must be a mapping'))
+        return
+
+    for key, value in node.value:
+        line_no = key.start_mark.line + 1
+        if key.value not in YAML_GROUP_KEYS:
+            errors.append((line_no, f'Unexpected key "{key.value}" in group "{name_node.value}"'))
+        elif key.value == 'hosts':
+            if isinstance(value, yaml.MappingNode):
+                for host_key, _ in value.value:
+                    if not HOST_NAME_RE.match(host_key.value or ''):
+                        errors.append((host_key.start_mark.line + 1, f'Invalid host format: {host_key.value}'))
+            elif not (isinstance(value, yaml.ScalarNode) and value.value in ('', '~', 'null')):
+                errors.append((line_no, f'"hosts" in group "{name_node.value}" must be a mapping'))
+        elif key.value == 'vars' and not isinstance(value, (yaml.MappingNode, yaml.ScalarNode)):
+            errors.append((line_no, f'"vars" in group "{name_node.value}" must be a mapping'))
+        elif key.value == 'children':
+            if isinstance(value, yaml.MappingNode):
+                for child_name, child in value.value:
+                    _validate_yaml_group(child_name, child, errors)
+            elif not (isinstance(value, yaml.ScalarNode) and value.value in ('', '~', 'null')):
+                errors.append((line_no, f'"children" in group "{name_node.value}" must be a mapping'))
+
+
+def _validate_yaml(content):
+    yaml = get_yaml()
+    if yaml is None:
+        return []  # PyYAML not installed; leave YAML inventories to ansible
+
+    try:
+        root = yaml.compose(content, Loader=yaml_loader(yaml))
+    except yaml.YAMLError as e:
+        line_no = e.problem_mark.line + 1 if getattr(e, 'problem_mark', None) else 0
+        return [(line_no, f'YAML syntax error: {getattr(e, "problem", None) or e}')]
+
+    if root is None:
+        return [(0, 'Inventory is empty')]
+    if not isinstance(root, yaml.MappingNode):
+        return [(root.start_mark.line + 1, 'YAML inventory must be a mapping of groups')]
+
+    errors = []
+    for name_node, group in root.value:
+        _validate_yaml_group(name_node, group, errors)
+    return errors
+
+
+def validate_inventory(content):
+    """
+    Validate an INI or YAML inventory.
+    Returns (valid, [(line_number, message), ...]); results are memoised by content hash.
+    """
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    with _cache_lock:
+        if digest in _cache:
+            _cache.move_to_end(digest)
+            return _cache[digest]
+
+    errors = _validate_yaml(content) if is_yaml_inventory(content) else _validate_ini(content)
+    result = (not errors, errors)
+
+    with _cache_lock:
+        _cache[digest] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def parse_yaml_hosts(content):
+    """Return the unique host names of a YAML inventory, in file order."""
+    yaml = get_yaml()
+    if yaml is None:
+        return []
+    try:
+        root = yaml.compose(content, Loader=yaml_loader(yaml))
+    except yaml.YAMLError:
+        return []
+    if not isinstance(root, yaml.MappingNode):
+        return []
+
+    hosts = []
+    seen = set()
+    for _, group in root.value:
+        for host_key in _yaml_host_nodes(group):
+            if host_key.value not in seen:
+                seen.add(host_key.value)
+                hosts.append(host_key.value)
+    return hosts
+
+
+def parse_yaml_groups(content):
+    """
+    Return {group: [direct hosts]} and {group: [child groups]} for a YAML
+    inventory, or ({}, {}) if it can't be parsed.
+    """
+    yaml = get_yaml()
+    if yaml is None:
+        return {}, {}
+    try:
+        root = yaml.compose(content, Loader=yaml_loader(yaml))
+    except yaml.YAMLError:
+        return {}, {}
+    if not isinstance(root, yaml.MappingNode):
+        return {}, {}
+
+    groups = {}
+    children = {}
+
+    def walk(name, node):
+        groups.setdefault(name, [])
+        children.setdefault(name, [])
+        if not isinstance(node, yaml.MappingNode):
+            return
+        for key, value in node.value:
+            if not isinstance(value, yaml.MappingNode):
+                continue
+            if key.value == 'hosts':
+                groups[name].extend(host_key.value for host_key, _ in value.value)
+            elif key.value == 'children':
+                for child_name, child in value.value:
+                    children[name].append(child_name.value)
+                    walk(child_name.value, child)
+
+    for name_node, group in root.value:
+        walk(name_node.value, group)
+    return groups, children
+
+
+def benchmark(hosts=10000):
+    """
+    Validate generated INI and YAML inventories of the given size, with
+    host variables, cold and then memoised.
+    Returns {format: (cold_seconds, memoised_seconds, valid)}.
+    """
+    groups = [f'group{g}' for g in range(max(1, hosts // 500))]
+    ini = []
+    yaml_lines = ['all:', '  children:']
+    for g, group in enumerate(groups):
+        ini.append(f'[{group}]')
+        yaml_lines.extend([f'    {group}:', '      hosts:'])
+        for i in range(g, hosts, len(groups)):
+            ini.append(f'host{i:05d}.example.com ansible_host=10.0.{i // 256 % 256}.{i % 256} ansible_user="deploy"')
+            yaml_lines.extend([f'        host{i:05d}.example.com:', f'          ansible_host: 10.0.{i // 256 % 256}.{i % 256}'])
+        ini.extend([f'[{group}:vars]', 'ntp_server=ntp.example.com'])
+
+    inventories = {'ini': '\n'.join(ini) + '\n'}
+    if get_yaml() is not None:
+        inventories['yaml'] = '\n'.join(yaml_lines) + '\n'
+
+    results = {}
+    for name, content in inventories.items():
+        with _cache_lock:
+            _cache.clear()
+        start = time.perf_counter()
+        valid, _ = validate_inventory(content)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        validate_inventory(content)
+        results[name] = (cold, time.perf_counter() - start, valid)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'benchmark':
+        print('Usage: python inventory_validator.py benchmark [hosts]')
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else 10000
+    print(f'{count} hosts with variables:')
+    for name, (cold, memoised, valid) in benchmark(count).items():
+        print(f'   {name:<5} {cold * 1000:8.1f} ms cold  {memoised * 1000:6.2f} ms memoised  valid={valid}')
+    if get_yaml() is None:
+        print('   yaml  skipped (pip install pyyaml)')
@@ -0,0 +1,570 @@
+"""
+Ekumen - Job Manager
+Stores queued and completed jobs on disk so that every gunicorn worker and
+every remote agent sees the same queue.
+"""
+
+import fcntl
+import hashlib
+import json
+import re
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from output_parser import failed_hosts, split_host_output
+from rate_limiter import pid_alive
+
+# Payload fields that are never written to the job record itself
+SECRET_FIELDS = ('password', 'become_password')
+
+# Statuses tracked in the active-job index
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class JobManager:
+    """Manages the job queue, job output and registered worker agents."""
+
+    def __init__(self, job_dir, host_index=None, agent_timeout=60, run_timeout=900, rate_limiter=None):
+        self.job_dir = job_dir
+        # Optional HostIndex fed with the results of every finished job
+        self.host_index = host_index
+        # Optional RateLimiter whose job leases are released when jobs finish
+        self.rate_limiter = rate_limiter
+        # Running jobs are failed when their agent hasn't been seen for
+        # agent_timeout seconds, or when they have run for run_timeout
+        self.agent_timeout = agent_timeout
+        self.run_timeout = run_timeout
+        self.agent_dir = os.path.join(job_dir, 'agents')
+        self.diff_dir = os.path.join(job_dir, 'diffs')
+        # Ids of queued and running jobs, so polls don't read the whole history
+        self.active_path = os.path.join(job_dir, '.active.json')
+
+    def _ensure_dir(self):
+        """Create job directories if they don't exist."""
+        for path in (self.job_dir, self.agent_dir, self.diff_dir):
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(path, exist_ok=True)
+                except OSError:
+                    pass  # May fail on read-only filesystem
+
+    @contextmanager
+    def _lock(self):
+        """Serialise queue updates across processes."""
+        self._ensure_dir()
+        with open(os.path.join(self.job_dir, '.queue.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, job_id, suffix='.json'):
+        """Return the path of a job file, rejecting anything but hex ids."""
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        return os.path.join(self.job_dir, job_id + suffix)
+
+    def _write_json(self, path, data, mode=0o644):
+        """Write JSON atomically so readers never see a partial file."""
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _scan_jobs(self):
+        """Read every job record on disk."""
+        if not os.path.exists(self.job_dir):
+            return []
+        jobs = []
+        for f in os.listdir(self.job_dir):
+            if not f.endswith('.json') or f.startswith('.'):
+                continue
+            try:
+                jobs.append(self._read_json(os.path.join(self.job_dir, f)))
+            except (OSError, ValueError):
+                continue
+        return jobs
+
+    def _read_active(self):
+        """Ids in the active-job index, or None if it hasn't been built yet."""
+        try:
+            return set(self._read_json(self.active_path))
+        except (OSError, ValueError):
+            return None
+
+    def _update_active(self, add=(), remove=()):
+        """
+        Add or remove ids in the active-job index, building it from a full
+        scan the first time. The index may list jobs that have since
+        finished; the job files are authoritative. Caller holds the lock.
+        """
+        active = self._read_active()
+        if active is None:
+            active = {j['id'] for j in self._scan_jobs() if j.get('status') in ACTIVE_STATUSES}
+        active = (active | set(add)) - set(remove)
+        self._write_json(self.active_path, sorted(active))
+
+    # ========== JOBS ==========
+
+    def create_job(self, payload, route=None, source='api', not_before=None, lease=None):
+        """
+        Queue a job. Jobs with not_before are not handed out before that time.
+        lease ({'key', 'id'}) is a rate limiter lease held until the job finishes.
+        Returns (success, job_id_or_error).
+        """
+        self._ensure_dir()
+        job_id = uuid.uuid4().hex[:16]
+        public = {k: v for k, v in payload.items() if k not in SECRET_FIELDS}
+        secrets = {k: payload[k] for k in SECRET_FIELDS if payload.get(k)}
+
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'route': route,
+            'source': source,
+            'agent': None,
+            'created': time.time(),
+            'not_before': not_before,
+            'started': None,
+            'finished': None,
+            'success': None,
+            'error': '',
+            'payload': public,
+        }
+        if lease:
+            job['lease'] = lease
+
+        try:
+            with self._lock():
+                if secrets:
+                    # Passwords only live on disk until an agent claims the job
+                    self._write_json(self._path(job_id, '.secret'), secrets, mode=0o600)
+                # Indexed first: an id without a job file is dropped on the next poll
+                self._update_active(add=[job_id])
+                self._write_json(self._path(job_id), job)
+            return True, job_id
+        except Exception as e:
+            return False, str(e)
+
+    def get_job(self, job_id):
+        """Get a job record by id. Returns (success, job_or_error)."""
+        path = self._path(job_id)
+        if not path or not os.path.exists(path):
+            return False, 'Job not found'
+        try:
+            return True, self._read_json(path)
+        except Exception as e:
+            return False, str(e)
+
+    def list_jobs(self, status=None, limit=100):
+        """
+        List job records, newest first. Queued and running jobs are read
+        through the active-job index, without scanning finished ones.
+        """
+        active = self._read_active() if status in ACTIVE_STATUSES else None
+        if active is None:
+            jobs = self._scan_jobs()
+        else:
+            jobs = []
+            for job_id in active:
+                try:
+                    jobs.append(self._read_json(self._path(job_id)))
+                except (OSError, ValueError, TypeError):
+                    continue
+
+        jobs = [j for j in jobs if not status or j.get('status') == status]
+        jobs.sort(key=lambda j: j.get('created', 0), reverse=True)
+        return jobs[:limit]
+
+    def _finish(self, job, status, error):
+        """Mark a job finished and drop it from the active index. Caller holds the lock."""
+        job['status'] = status
+        job['success'] = status == 'completed'
+        job['error'] = error
+        job['finished'] = time.time()
+        lease = job.pop('lease', None)
+        self._write_json(self._path(job['id']), job)
+        self._update_active(remove=[job['id']])
+        if lease and self.rate_limiter:
+            self.rate_limiter.release(lease['key'], lease['id'])
+
+    def _is_stale(self, job, now, agents):
+        """Why a running job can no longer finish, or None if it still can."""
+        if self.run_timeout and now - (job.get('started') or now) > self.run_timeout:
+            return f'Job exceeded the run timeout ({self.run_timeout} s)'
+        if job.get('route') == 'local':
+            # Run in a thread of the scheduler leader, which sends heartbeats
+            if job.get('owner_host') == socket.gethostname() and not pid_alive(job.get('owner_pid', 0)):
+                return 'Scheduler process exited during the run'
+            if self.agent_timeout and now - job.get('heartbeat', now) > self.agent_timeout:
+                return 'Scheduler stopped sending heartbeats'
+            return None
+        name = job.get('agent')
+        if name not in agents:
+            found, agent = self.get_agent(name or '')
+            agents[name] = agent.get('last_seen', 0) if found else 0
+        if self.agent_timeout and now - agents[name] > self.agent_timeout:
+            return f'Agent {name} stopped responding'
+        return None
+
+    def _fail_stale_jobs(self):
+        """Fail running jobs whose owner is gone. Caller holds the lock. Returns their ids."""
+        now = time.time()
+        agents = {}  # name -> last_seen, read once per pass
+        failed = []
+        for job in self.list_jobs(status='running', limit=None):
+            reason = self._is_stale(job, now, agents)
+            if reason:
+                self._finish(job, 'failed', reason)
+                failed.append(job['id'])
+        return failed
+
+    def fail_stale_jobs(self):
+        """
+        Fail running jobs that can no longer finish: their agent stopped
+        sending heartbeats, or they outlived the run timeout.
+        Returns the ids of the jobs failed.
+        """
+        with self._lock():
+            return self._fail_stale_jobs()
+
+    def claim_job(self, agent_name, groups=None, local=False):
+        """
+        Claim the oldest queued job this agent may run.
+        Jobs without a route go to any agent; routed jobs only go to agents
+        serving that group. Jobs routed 'local' are only claimed with
+        local=True, by the controller itself. Returns the job with its
+        secrets, or None.
+        """
+        groups = set(groups or [])
+        now = time.time()
+        with self._lock():
+            self._fail_stale_jobs()
+            queued = self.list_jobs(status='queued', limit=None)
+            # Drop index entries whose job finished or vanished between writes
+            live = {j['id'] for j in queued + self.list_jobs(status='running', limit=None)}
+            finished = (self._read_active() or set()) - live
+            if finished:
+                self._update_active(remove=finished)
+
+            for job in reversed(queued):
+                route = job.get('route')
+                if local != (route == 'local'):
+                    continue
+                if not local and route and route not in groups:
+                    continue
+                if job.get('not_before') and job['not_before'] > now:
+                    continue
+
+                job['status'] = 'running'
+                job['agent'] = agent_name
+                job['started'] = time.time()
+                if local:
+                    job['owner_host'] = socket.gethostname()
+                    job['owner_pid'] = os.getpid()
+                    job['heartbeat'] = job['started']
+                self._write_json(self._path(job['id']), job)
+
+                payload = dict(job['payload'])
+                secret_path = self._path(job['id'], '.secret')
+                if os.path.exists(secret_path):
+                    payload.update(self._read_json(secret_path))
+                    os.remove(secret_path)
+                return dict(job, payload=payload)
+        return None
+
+    def cancel_job(self, job_id, reason='Cancelled'):
+        """
+        Fail a queued or running job so no agent starts it any more (a job
+        already running on an agent can't be stopped from here).
+        Returns (success, error_or_none).
+        """
+        with self._lock():
+            success, job = self.get_job(job_id)
+            if not success:
+                return False, job
+            if job['status'] not in ACTIVE_STATUSES:
+                return False, 'Job has already finished'
+            secret_path = self._path(job_id, '.secret')
+            if os.path.exists(secret_path):
+                os.remove(secret_path)
+            try:
+                self._finish(job, 'failed', reason)
+            except Exception as e:
+                return False, str(e)
+        return True, None
+
+    def heartbeat(self, job_ids):
+        """Record that the local jobs in job_ids are still being run by this process."""
+        if not job_ids:
+            return
+        with self._lock():
+            for job_id in job_ids:
+                success, job = self.get_job(job_id)
+                if success and job['status'] == 'running':
+                    job['heartbeat'] = time.time()
+                    self._write_json(self._path(job_id), job)
+
+    def rerun_payload(self, job_id, only='failed', secrets=None):
+        """
+        The payload of a rerun: the job's payload limited to the hosts that
+        failed or were unreachable ('failed', like an Ansible retry file),
+        only the unreachable ones ('unreachable'), or not limited ('all').
+        Passwords are not kept after a job is claimed, so they have to be
+        passed again in secrets.
+        Returns (success, payload_or_error).
+        """
+        if only not in ('failed', 'unreachable', 'all'):
+            return False, 'only must be failed, unreachable or all'
+        success, job = self.get_job(job_id)
+        if not success:
+            return False, job
+        if job['status'] not in ('completed', 'failed'):
+            return False, 'Job has not finished'
+
+        payload = dict(job['payload'])
+        if only != 'all':
+            hosts = list(job.get('unreachable_hosts', []))
+            if only == 'failed':
+                hosts = job.get('failed_hosts', []) + hosts
+            if not hosts:
+                return False, f'Job has no {only} hosts'
+            # Long host lists are passed to ansible as an @file limit by the runner
+            payload['limit'] = ','.join(hosts)
+            payload['sharded'] = False
+
+        payload.update({k: v for k, v in (secrets or {}).items() if k in SECRET_FIELDS})
+        return True, payload
+
+    def rerun_job(self, job_id, only='failed', secrets=None, lease=None):
+        """Queue the rerun described by rerun_payload(). Returns (success, job_id_or_error)."""
+        success, payload = self.rerun_payload(job_id, only, secrets)
+        if not success:
+            return False, payload
+        route = self.get_job(job_id)[1].get('route')
+        return self.create_job(payload, route=route, source=f'rerun:{job_id}', lease=lease)
+
+    def append_output(self, job_id, text):
+        """Append streamed output to a job log. Returns (success, error_or_none)."""
+        path = self._path(job_id, '.log')
+        if not path or not os.path.exists(self._path(job_id)):
+            return False, 'Job not found'
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(text)
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+    def get_output(self, job_id):
+        """Get the output collected for a job so far."""
+        path = self._path(job_id, '.log')
+        if not path or not os.path.exists(path):
+            return ''
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def read_output_bytes(self, job_id, offset=0):
+        """Read a job's output from a byte offset, for incremental streaming."""
+        path = self._path(job_id, '.log')
+        if not path or not os.path.exists(path):
+            return b''
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read()
+
+    def complete_job(self, job_id, result):
+        """
+        Record the final result of a job, including the hosts that failed or
+        were unreachable (what Ansible would put in a retry file).
+        Returns (success, error_or_none).
+        """
+        output = self.get_output(job_id)
+        failed, unreachable = failed_hosts(output)
+        with self._lock():
+            success, job = self.get_job(job_id)
+            if not success:
+                return False, job
+
+            job['failed_hosts'] = failed
+            job['unreachable_hosts'] = unreachable
+            try:
+                self._finish(job, 'completed' if result.get('success') else 'failed', result.get('error', ''))
+            except Exception as e:
+                return False, str(e)
+
+        self._index(job, output)
+        return True, None
+
+    def record_run(self, payload, result, route=None, source='run', started=None):
+        """
+        Keep a run that finished outside the queue (a synchronous /run) as a
+        finished job, so it can be rerun and diffed like any other job.
+        route is where reruns of it are sent.
+        Returns (success, job_id_or_error).
+        """
+        self._ensure_dir()
+        job_id = uuid.uuid4().hex[:16]
+        output = result.get('output', '')
+        failed, unreachable = failed_hosts(output)
+        now = time.time()
+        job = {
+            'id': job_id,
+            'status': 'completed' if result.get('success') else 'failed',
+            'route': route,
+            'source': source,
+            'agent': None,
+            'created': started or now,
+            'not_before': None,
+            'started': started or now,
+            'finished': now,
+            'success': bool(result.get('success')),
+            'error': result.get('error', ''),
+            'payload': {k: v for k, v in payload.items() if k not in SECRET_FIELDS},
+            'failed_hosts': failed,
+            'unreachable_hosts': unreachable,
+        }
+        try:
+            # Never in the active index, so no queue lock; the log goes first
+            # so the job is never seen without its output
+            with open(self._path(job_id, '.log'), 'w', encoding='utf-8') as f:
+                f.write(output)
+            self._write_json(self._path(job_id), job)
+        except Exception as e:
+            return False, str(e)
+        self._index(job, output)
+        return True, job_id
+
+    def _index(self, job, output):
+        """Queue a finished job's output for the host index."""
+        if self.host_index:
+            payload = job['payload']
+            module = payload.get('module', 'ping') if payload.get('mode', 'adhoc') == 'adhoc' else 'playbook'
+            self.host_index.record_later(output, job_id=job['id'], module=module, finished=job['finished'])
+
+    def diff_jobs(self, from_id, to_id, ignore=None):
+        """
+        Compare the output of two jobs host by host. Only hosts whose output
+        differs are returned, each with a unified diff; lines matching the
+        ignore regex (e.g. timestamps) are left out of the comparison.
+        Results for two finished jobs are cached on disk.
+        Returns (success, result_or_error).
+        """
+        jobs = []
+        for job_id in (from_id, to_id):
+            success, job = self.get_job(job_id)
+            if not success:
+                return False, f'{job}: {job_id}'
+            jobs.append(job)
+        try:
+            ignore_re = re.compile(ignore) if ignore else None
+        except re.error as e:
+            return False, f'Invalid ignore pattern: {e}'
+
+        finished = all(job['status'] in ('completed', 'failed') for job in jobs)
+        digest = hashlib.sha256(f'{from_id}\0{to_id}\0{ignore or ""}'.encode('utf-8')).hexdigest()[:32]
+        cache_path = os.path.join(self.diff_dir, digest + '.json')
+        if finished and os.path.exists(cache_path):
+            try:
+                return True, dict(self._read_json(cache_path), cached=True)
+            except (OSError, ValueError):
+                pass
+
+        import difflib
+
+        before, after = (split_host_output(self.get_output(job_id)) for job_id in (from_id, to_id))
+        hosts = {}
+        unchanged = 0
+        for host in list(before) + [h for h in after if h not in before]:
+            old = [l for l in before.get(host, []) if not (ignore_re and ignore_re.search(l))]
+            new = [l for l in after.get(host, []) if not (ignore_re and ignore_re.search(l))]
+            if old == new:
+                unchanged += 1
+                continue
+            diff = difflib.unified_diff(old, new, fromfile=f'{from_id}/{host}', tofile=f'{to_id}/{host}', lineterm='')
+            change = 'changed' if host in before and host in after else 'removed' if host in before else 'added'
+            hosts[host] = {'change': change, 'diff': '\n'.join(diff)}
+
+        result = {
+            'from': from_id,
+            'to': to_id,
+            'hosts': hosts,
+            'summary': {
+                'changed': sum(1 for h in hosts.values() if h['change'] == 'changed'),
+                'added': sum(1 for h in hosts.values() if h['change'] == 'added'),
+                'removed': sum(1 for h in hosts.values() if h['change'] == 'removed'),
+                'unchanged': unchanged,
+            },
+        }
+        if finished:
+            try:
+                self._ensure_dir()
+                self._write_json(cache_path, result)
+            except OSError:
+                pass  # Caching is best effort
+        return True, dict(result, cached=False)
+
+    # ========== AGENTS ==========
+
+    def register_agent(self, name, groups=None, capacity=1):
+        """Register or refresh a worker agent. Returns (success, agent_or_error)."""
+        self._ensure_dir()
+        safe_name = ''.join(c for c in name if c.isalnum() or c in '-_.')
+        if not safe_name:
+            return False, 'Agent name is required'
+
+        agent = {
+            'name': safe_name,
+            'groups': list(groups or []),
+            'capacity': max(1, int(capacity)),
+            'last_seen': time.time(),
+        }
+        try:
+            self._write_json(os.path.join(self.agent_dir, safe_name + '.json'), agent)
+            return True, agent
+        except Exception as e:
+            return False, str(e)
+
+    def get_agent(self, name):
+        """Get a registered agent. Returns (success, agent_or_error)."""
+        path = os.path.join(self.agent_dir, os.path.basename(name) + '.json')
+        if not os.path.exists(path):
+            return False, 'Agent not registered'
+        try:
+            return True, self._read_json(path)
+        except Exception as e:
+            return False, str(e)
+
+    def list_agents(self, max_age=None):
+        """List registered agents, optionally only those seen recently."""
+        if not os.path.exists(self.agent_dir):
+            return []
+
+        now = time.time()
+        running = {}
+        for job in self.list_jobs(status='running', limit=None):
+            running[job.get('agent')] = running.get(job.get('agent'), 0) + 1
+
+        agents = []
+        for f in sorted(os.listdir(self.agent_dir)):
+            if not f.endswith('.json'):
+                continue
+            try:
+                agent = self._read_json(os.path.join(self.agent_dir, f))
+            except (OSError, ValueError):
+                continue
+            if max_age and now - agent.get('last_seen', 0) > max_age:
+                continue
+            agent['running'] = running.get(agent['name'], 0)
+            agents.append(agent)
+        return agents
@@ -0,0 +1,135 @@
+"""
+Ekumen - Load Test
+Measures how many concurrent /run requests each gunicorn worker profile
+can hold open. Every profile is started on a free port with the mock
+backend, so each run simply takes about ANSIBLE_SHUTTLE_MOCK_DELAY seconds
+without ansible or SSH, and all requests are fired at once.
+
+Usage:
+    python loadtest.py [requests] [delay] [modes]
+    python loadtest.py 200 1 sync,gthread,gevent
+"""
+
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUN_BODY = {'mode': 'adhoc', 'module': 'ping', 'inventory': '[web]\nweb1\n', 'become': False}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_server(mode, port, delay, state_dir):
+    """Start gunicorn with one worker profile and wait until it answers."""
+    env = dict(
+        os.environ,
+        ANSIBLE_SHUTTLE_WORKER_MODE=mode,
+        ANSIBLE_SHUTTLE_HOST='127.0.0.1',
+        ANSIBLE_SHUTTLE_PORT=str(port),
+        ANSIBLE_SHUTTLE_BACKEND='mock',
+        ANSIBLE_SHUTTLE_MOCK_DELAY=str(delay),
+        ANSIBLE_SHUTTLE_SCHEDULER='false',
+        # The test client is a single caller; its limits would dominate
+        ANSIBLE_SHUTTLE_RATE_LIMIT_RUNS='0',
+        ANSIBLE_SHUTTLE_RATE_LIMIT_CONCURRENT='0',
+        ANSIBLE_SHUTTLE_JOB_DIR=os.path.join(state_dir, 'jobs'),
+        ANSIBLE_SHUTTLE_RATE_LIMIT_DIR=os.path.join(state_dir, 'ratelimits'),
+        ANSIBLE_SHUTTLE_HOST_INDEX=os.path.join(state_dir, 'hosts.db'),
+        ANSIBLE_SHUTTLE_SCHEDULE_DIR=os.path.join(state_dir, 'schedules'),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(HERE, 'gunicorn.conf.py'), 'app:app'],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/usage', timeout=1).close()
+            return proc
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'gunicorn ({mode}) did not start')
+
+
+def _fire(port, requests):
+    """Send all requests at once. Returns (wall_seconds, [latencies], errors)."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Event()
+    body = json.dumps(RUN_BODY).encode('utf-8')
+
+    def one():
+        start.wait()
+        began = time.perf_counter()
+        try:
+            req = urllib.request.Request(f'http://127.0.0.1:{port}/run', data=body,
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+            with urllib.request.urlopen(req, timeout=600) as resp:
+                ok = json.loads(resp.read().decode('utf-8')).get('success')
+            with lock:
+                (latencies if ok else errors).append(time.perf_counter() - began)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            with lock:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=one) for _ in range(requests)]
+    for t in threads:
+        t.start()
+    began = time.perf_counter()
+    start.set()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - began, latencies, errors
+
+
+def load_test(requests=200, delay=1.0, modes=('sync', 'gthread', 'gevent')):
+    """
+    Run the load test for each worker mode.
+    Returns {mode: (wall_seconds, [latencies], errors)}; skipped modes are left out.
+    """
+    results = {}
+    for mode in modes:
+        if mode == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print('   gevent       skipped (pip install gevent)')
+                continue
+        state_dir = tempfile.mkdtemp(prefix='ekumen_load_')
+        port = _free_port()
+        proc = _start_server(mode, port, delay, state_dir)
+        try:
+            results[mode] = _fire(port, requests)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(state_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    run_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    selected = sys.argv[3].split(',') if len(sys.argv) > 3 else ('sync', 'gthread', 'gevent')
+    print(f'{count} concurrent /run requests, ~{run_delay:g} s each (mock backend):')
+    for name, (wall, latencies, failures) in load_test(count, run_delay, selected).items():
+        p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1] if latencies else 0
+        median = statistics.median(latencies) if latencies else 0
+        print(f'   {name:<8} {wall:6.1f} s wall  {len(latencies) / wall:6.1f} runs/s  '
+              f'p50 {median:5.1f} s  p95 {p95:5.1f} s  errors {len(failures)}')
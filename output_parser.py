@@ -0,0 +1,152 @@
+"""
+Ekumen - Output Parser
+Helpers for reading structure back out of plain Ansible text output.
+"""
+
+import re
+
+RECAP_HEADER_RE = re.compile(r'^PLAY RECAP \**')
+RECAP_LINE_RE = re.compile(r'^(\S+)\s*:\s+((?:\w+=\d+\s*)+)$')
+RECAP_FIELDS = ('ok', 'changed', 'unreachable', 'failed', 'skipped', 'rescued', 'ignored')
+ADHOC_HEADER_RE = re.compile(r'^(\S+) \| (SUCCESS|CHANGED|FAILED|UNREACHABLE|SKIPPED)!?(?: |$)')
+TASK_HEADER_RE = re.compile(r'^(PLAY|TASK|RUNNING HANDLER) \[(.*)\] \**$')
+HOST_RESULT_RE = re.compile(r'^(ok|changed|skipping|fatal|failed|unreachable|rescued): \[([^\]]+)\]')
+FATAL_RE = re.compile(r'^fatal: \[([^\]]+)\]: (FAILED|UNREACHABLE)!')
+# Precedes the recap a sharded run adds by summing its shards' recaps
+MERGED_RECAP_MARKER = '=== MERGED ==='
+
+
+def parse_recap(output):
+    """
+    Parse the PLAY RECAP section(s) of playbook output, summing them.
+    The merged recap of a sharded run repeats its shards' totals and is skipped.
+    Returns {host: {'ok': n, 'changed': n, ...}} in order of appearance.
+    """
+    stats = {}
+    in_recap = False
+    for line in output.splitlines():
+        line = line.rstrip()
+        if line == MERGED_RECAP_MARKER:
+            break
+        if RECAP_HEADER_RE.match(line):
+            in_recap = True
+            continue
+        if not in_recap:
+            continue
+        match = RECAP_LINE_RE.match(line.strip())
+        if not match:
+            if line.strip():
+                in_recap = False
+            continue
+        host_stats = stats.setdefault(match.group(1), dict.fromkeys(RECAP_FIELDS, 0))
+        for pair in match.group(2).split():
+            key, value = pair.split('=')
+            host_stats[key] = host_stats.get(key, 0) + int(value)
+    return stats
+
+
+def format_recap(stats):
+    """Render recap stats in the same layout ansible-playbook uses."""
+    lines = ['PLAY RECAP ' + '*' * 69]
+    width = max((len(h) for h in stats), default=0)
+    for host, host_stats in stats.items():
+        counters = '    '.join(f'{k}={host_stats.get(k, 0)}' for k in RECAP_FIELDS)
+        lines.append(f'{host.ljust(width)} : {counters}')
+    return '\n'.join(lines)
+
+
+def split_adhoc_output(output):
+    """
+    Split ad-hoc output into per-host sections.
+    Returns {host: {'status': 'SUCCESS'|'CHANGED'|..., 'output': text}}.
+    """
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        match = ADHOC_HEADER_RE.match(line)
+        if match:
+            current = sections.setdefault(match.group(1), {'status': match.group(2), 'lines': []})
+            current['status'] = match.group(2)
+        if current is not None:
+            current['lines'].append(line)
+
+    return {
+        host: {'status': section['status'], 'output': '\n'.join(section['lines'])}
+        for host, section in sections.items()
+    }
+
+
+def failed_hosts(output):
+    """
+    Hosts that failed or were unreachable in a run, in order of appearance.
+    Uses the play recap when there is one, otherwise the per-host ad-hoc
+    results or 'fatal:' task lines (e.g. for a run that was cut short).
+    Returns (failed, unreachable).
+    """
+    failed, unreachable = [], []
+    recap = parse_recap(output)
+    if recap:
+        for host, host_stats in recap.items():
+            if host_stats.get('unreachable'):
+                unreachable.append(host)
+            elif host_stats.get('failed'):
+                failed.append(host)
+        return failed, unreachable
+
+    statuses = {host: section['status'] for host, section in split_adhoc_output(output).items()}
+    for line in output.splitlines():
+        match = FATAL_RE.match(line)
+        if match and match.group(1) not in statuses:
+            statuses[match.group(1)] = match.group(2)
+    for host, status in statuses.items():
+        if status == 'UNREACHABLE':
+            unreachable.append(host)
+        elif status == 'FAILED':
+            failed.append(host)
+    return failed, unreachable
+
+
+def split_host_output(output):
+    """
+    Split ad-hoc or playbook output into per-host lines so two runs can be
+    compared host by host. Playbook results are kept under their task
+    header, and each host ends with its recap line.
+    Returns {host: [lines]} in order of appearance.
+    """
+    adhoc = split_adhoc_output(output)
+    if adhoc:
+        return {host: section['output'].splitlines() for host, section in adhoc.items()}
+
+    hosts = {}
+    last_task = {}
+    task = None
+    block_host = None  # Host whose multi-line "=> {...}" result is being read
+    for line in output.splitlines():
+        line = line.rstrip()
+        if block_host:
+            hosts[block_host].append(line)
+            if line == '}':
+                block_host = None
+            continue
+
+        header = TASK_HEADER_RE.match(line)
+        if header:
+            task = f'{header.group(1)} [{header.group(2)}]'
+            continue
+
+        match = HOST_RESULT_RE.match(line)
+        if not match:
+            continue
+        host = match.group(2).split(' -> ')[0]
+        lines = hosts.setdefault(host, [])
+        if task and last_task.get(host) != task:
+            lines.append(task)
+            last_task[host] = task
+        lines.append(line)
+        if line.endswith('{'):
+            block_host = host
+
+    for host, host_stats in parse_recap(output).items():
+        counters = ' '.join(f'{k}={host_stats.get(k, 0)}' for k in RECAP_FIELDS)
+        hosts.setdefault(host, []).append(f'RECAP {counters}')
+    return hosts
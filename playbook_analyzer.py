@@ -0,0 +1,322 @@
+"""
+Ekumen - Playbook Analyzer
+Static pre-flight analysis of a playbook before it is run: plays, tasks,
+modules, tags and an estimated host x task count, with modules outside the
+allowed list flagged. Parsed files are memoised by content hash, so only
+the cheap host estimate is recomputed when the inventory or limit changes.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from inventory_manager import match_hosts, parse_inventory_groups
+from inventory_validator import get_yaml, yaml_loader
+
+# Task keywords that are not the module being called
+TASK_KEYWORDS = {
+    'name', 'action', 'args', 'when', 'tags', 'register', 'notify', 'listen',
+    'loop', 'loop_control', 'vars', 'environment', 'become', 'become_user',
+    'become_method', 'become_flags', 'become_exe', 'ignore_errors',
+    'ignore_unreachable', 'failed_when', 'changed_when', 'until', 'retries',
+    'delay', 'delegate_to', 'delegate_facts', 'run_once', 'no_log',
+    'check_mode', 'diff', 'any_errors_fatal', 'async', 'poll', 'throttle',
+    'timeout', 'connection', 'remote_user', 'debugger', 'module_defaults',
+    'collections', 'local_action', 'port', 'block', 'rescue', 'always',
+}
+BLOCK_SECTIONS = ('block', 'rescue', 'always')
+PLAY_TASK_SECTIONS = ('pre_tasks', 'tasks', 'post_tasks')
+INCLUDE_MODULES = {'include_tasks', 'import_tasks', 'include'}
+PLAYBOOK_INCLUDES = {'import_playbook', 'include_playbook'}
+MODULE_PREFIX_RE = re.compile(r'^ansible\.(?:builtin|legacy)\.')
+TEMPLATED_RE = re.compile(r'{{|{%')
+LOCAL_HOSTS = {'localhost', '127.0.0.1'}
+# Used to spot sharding hazards when PyYAML isn't installed
+SHARD_HAZARD_RE = re.compile(r'^\s*-?\s*(run_once|serial|local_action|delegate_to)\s*:', re.MULTILINE)
+
+MAX_INCLUDE_DEPTH = 10
+CACHE_SIZE = 128
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _short_module(name):
+    """ansible.builtin.copy -> copy; other collection names are kept."""
+    return MODULE_PREFIX_RE.sub('', name)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [t.strip() for t in value.split(',') if t.strip()]
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def _include_target(task, module):
+    """File named by an include/import task, or None."""
+    value = task.get(module)
+    if isinstance(value, dict):
+        value = value.get('file')
+    if isinstance(value, str) and value.strip():
+        # Free-form "file.yml var=x"; templated names are kept whole
+        return value.strip() if TEMPLATED_RE.search(value) else value.split()[0]
+    return None
+
+
+def _runs_once(task, inherited=False):
+    """Whether a task runs once per play rather than once per host (run_once or on the controller)."""
+    if inherited or task.get('run_once') not in (None, False, 'no', 'false'):
+        return True
+    return 'local_action' in task or str(task.get('delegate_to', '')).strip() in LOCAL_HOSTS
+
+
+def _summarize_tasks(tasks, inherited_tags=(), inherited_once=False):
+    """
+    Flatten a task list (blocks included) into
+    [{'module', 'tags', 'run_once', 'include'}, ...] in file order.
+    """
+    summary = []
+    if not isinstance(tasks, list):
+        return summary
+
+    for task in tasks:
+        if not isinstance(task, dict):
+            continue
+        tags = list(inherited_tags) + _as_list(task.get('tags'))
+        once = _runs_once(task, inherited_once)
+
+        if any(section in task for section in BLOCK_SECTIONS):
+            for section in BLOCK_SECTIONS:
+                summary.extend(_summarize_tasks(task.get(section), tags, once))
+            continue
+
+        module = task.get('local_action') or task.get('action')
+        if isinstance(module, dict):
+            module = module.get('module')
+        elif isinstance(module, str):
+            module = module.split()[0] if module.strip() else None
+        if not module:
+            module = next((k for k in task if k not in TASK_KEYWORDS), None)
+
+        entry = {'module': _short_module(str(module)) if module else None, 'tags': tags, 'run_once': once}
+        if entry['module'] in INCLUDE_MODULES:
+            entry['include'] = _include_target(task, module)
+        summary.append(entry)
+    return summary
+
+
+def _parse(content):
+    """
+    Parse playbook or task-file YAML into a structural summary.
+    Memoised by content hash. Returns (success, summary_or_error).
+    """
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    with _cache_lock:
+        if digest in _cache:
+            _cache.move_to_end(digest)
+            return _cache[digest]
+
+    yaml = get_yaml()
+    try:
+        document = yaml.load(content, Loader=yaml_loader(yaml))
+    except yaml.YAMLError as e:
+        mark = getattr(e, 'problem_mark', None)
+        where = f' (line {mark.line + 1})' if mark else ''
+        return False, f'YAML syntax error{where}: {getattr(e, "problem", None) or e}'
+
+    items = document if isinstance(document, list) else []
+    plays = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        included = next((k for k in PLAYBOOK_INCLUDES if k in item), None)
+        if included:
+            plays.append({'import_playbook': _include_target(item, included)})
+            continue
+        if 'hosts' not in item:
+            continue  # A task file, not a playbook
+
+        tags = _as_list(item.get('tags'))
+        once = item.get('run_once') not in (None, False, 'no', 'false')
+        tasks = []
+        for section in PLAY_TASK_SECTIONS:
+            tasks.extend(_summarize_tasks(item.get(section), tags, once))
+        roles = []
+        for role in item.get('roles') or []:
+            role = role.get('role') or role.get('name') if isinstance(role, dict) else role
+            if role:
+                roles.append(str(role))
+        plays.append({
+            'name': str(item.get('name') or ''),
+            'hosts': ','.join(_as_list(item.get('hosts'))),
+            'tasks': tasks,
+            'handlers': len(_summarize_tasks(item.get('handlers'))),
+            'roles': roles,
+            'gather_facts': item.get('gather_facts', True) not in (False, 'no', 'false'),
+            'serial': item.get('serial') is not None,
+        })
+
+    result = (True, {'plays': plays, 'tasks': _summarize_tasks(items) if not plays else []})
+    with _cache_lock:
+        _cache[digest] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def _shard_blockers(plays):
+    """Reasons a run of these (expanded) plays can't be split into parallel --limit shards."""
+    blockers = []
+    for play in plays:
+        label = play['name'] or play['hosts']
+        if play['serial']:
+            blockers.append(f'play "{label}" uses serial')
+        once = [t['module'] or 'task' for t in play['tasks'] if t['run_once']]
+        if once:
+            blockers.append(f'play "{label}" has {len(once)} run_once/controller task(s) ({", ".join(sorted(set(once)))})')
+    return blockers
+
+
+def shard_blockers(content):
+    """
+    Reasons a playbook can't be sharded: every shard is a full
+    ansible-playbook run, so serial batches, run_once tasks and tasks on
+    the controller would run once per shard. Roles and included files are
+    not inspected. Without PyYAML, any mention of those keywords counts.
+    """
+    if get_yaml() is None:
+        return [f'uses {keyword}' for keyword in sorted(set(SHARD_HAZARD_RE.findall(content)))]
+    success, parsed = _parse(content)
+    if not success:
+        return []  # ansible-playbook will report the syntax error
+    return _shard_blockers([p for p in parsed['plays'] if 'import_playbook' not in p])
+
+
+class PlaybookAnalyzer:
+    """Resolves includes against the playbook library and builds the report."""
+
+    def __init__(self, playbook_dir, allowed_modules):
+        self.playbook_dir = playbook_dir
+        self.allowed_modules = set(allowed_modules or [])
+
+    def _read_include(self, name):
+        """Read an included file from the playbook library. Returns (success, content_or_error)."""
+        if not name or TEMPLATED_RE.search(name):
+            return False, 'templated path'
+        root = os.path.realpath(self.playbook_dir)
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep):
+            return False, 'outside the playbook library'
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return True, f.read()
+        except OSError:
+            return False, 'not found'
+
+    def _expand_tasks(self, tasks, report, depth):
+        """Inline included task files. Returns the flattened task list."""
+        expanded = []
+        for task in tasks:
+            if 'include' not in task:
+                expanded.append(task)
+                continue
+            name = task['include']
+            success, content = self._read_include(name) if depth < MAX_INCLUDE_DEPTH else (False, 'include depth exceeded')
+            if success:
+                success, content = _parse(content)
+            if not success:
+                report['unresolved_includes'].append({'file': name, 'reason': content})
+                expanded.append(dict(task, module=None))
+                continue
+            report['includes'].append(name)
+            included = [dict(t, tags=task['tags'] + t['tags'], run_once=task['run_once'] or t['run_once'])
+                        for t in content['tasks']]
+            expanded.extend(self._expand_tasks(included, report, depth + 1))
+        return expanded
+
+    def _expand_plays(self, plays, report, depth):
+        expanded = []
+        for play in plays:
+            if 'import_playbook' not in play:
+                expanded.append(dict(play, tasks=self._expand_tasks(play['tasks'], report, depth)))
+                continue
+            name = play['import_playbook']
+            success, content = self._read_include(name) if depth < MAX_INCLUDE_DEPTH else (False, 'include depth exceeded')
+            if success:
+                success, content = _parse(content)
+            if not success:
+                report['unresolved_includes'].append({'file': name, 'reason': content})
+                continue
+            report['includes'].append(name)
+            expanded.extend(self._expand_plays(content['plays'], report, depth + 1))
+        return expanded
+
+    def analyze(self, content, inventory='', limit=''):
+        """
+        Analyze playbook content against an optional inventory and limit.
+        Returns (success, report_or_error).
+        """
+        if not content or not content.strip():
+            return False, 'Playbook content is required.'
+        if get_yaml() is None:
+            return False, 'Playbook analysis requires PyYAML (pip install pyyaml).'
+
+        success, parsed = _parse(content)
+        if not success:
+            return False, parsed
+        if not parsed['plays']:
+            return False, 'No plays found (expected a list of plays with "hosts").'
+
+        report = {'includes': [], 'unresolved_includes': []}
+        plays = self._expand_plays(parsed['plays'], report, 0)
+        groups = parse_inventory_groups(inventory) if inventory and inventory.strip() else None
+
+        modules = {}
+        tags = set()
+        target_hosts = set()
+        play_reports = []
+        for play in plays:
+            play_modules = [t['module'] for t in play['tasks'] if t['module']]
+            for module in play_modules:
+                modules[module] = modules.get(module, 0) + 1
+            for task in play['tasks']:
+                tags.update(task['tags'])
+
+            task_count = len(play['tasks']) + (1 if play['gather_facts'] else 0)
+            play_report = {
+                'name': play['name'],
+                'hosts': play['hosts'],
+                'tasks': len(play['tasks']),
+                'handlers': play['handlers'],
+                'roles': play['roles'],
+                'gather_facts': play['gather_facts'],
+                'modules': sorted(set(play_modules)),
+            }
+            if groups is not None:
+                hosts = match_hosts(play['hosts'], groups, limit.strip() if limit else None)
+                target_hosts |= hosts
+                play_report['estimated_hosts'] = len(hosts)
+                play_report['estimated_task_runs'] = len(hosts) * task_count
+            play_reports.append(play_report)
+
+        report.update({
+            'plays': play_reports,
+            'task_count': sum(p['tasks'] for p in play_reports),
+            'modules': modules,
+            'tags': sorted(tags),
+            'unsafe_modules': sorted(m for m in modules
+                                     if self.allowed_modules and m not in self.allowed_modules
+                                     and m not in INCLUDE_MODULES),
+            'roles': sorted({r for p in play_reports for r in p['roles']}),
+            'shard_blockers': _shard_blockers(plays),
+        })
+        if groups is not None:
+            report['target_hosts'] = len(target_hosts)
+            report['estimated_task_runs'] = sum(p['estimated_task_runs'] for p in play_reports)
+        return True, report
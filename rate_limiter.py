@@ -0,0 +1,199 @@
+"""
+Ekumen - Rate Limiter
+Per-caller limits on runs, shared by every gunicorn worker through small
+state files under flock:
+
+  runs per minute  - token bucket, bursts up to the per-minute limit
+  concurrent runs  - leases held while a run executes
+  hosts per hour   - token bucket charged with the number of targeted hosts
+
+A limit of 0 disables that check. When the state directory cannot be
+written the limiter fails open: runs are admitted and not counted.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+
+
+class RateLimiter:
+    """Token buckets and concurrency leases per caller key (user or IP)."""
+
+    def __init__(self, state_dir, runs_per_minute=0, max_concurrent=0, hosts_per_hour=0, lease_ttl=900):
+        self.state_dir = state_dir
+        self.runs_per_minute = runs_per_minute
+        self.max_concurrent = max_concurrent
+        self.hosts_per_hour = hosts_per_hour
+        # Leases older than this are dropped (a worker died mid-run)
+        self.lease_ttl = lease_ttl
+        self._warned = False
+
+    @property
+    def enabled(self):
+        return bool(self.runs_per_minute or self.max_concurrent or self.hosts_per_hour)
+
+    def _ensure_dir(self):
+        if not os.path.exists(self.state_dir):
+            try:
+                os.makedirs(self.state_dir, exist_ok=True)
+            except OSError:
+                pass  # May fail on read-only filesystem
+
+    def _path(self, key):
+        return os.path.join(self.state_dir, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.json')
+
+    def _update(self, key, change):
+        """
+        Load a caller's state under an exclusive lock, apply change(state, now)
+        and write it back. Returns whatever change returns.
+        """
+        self._ensure_dir()
+        fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            state.setdefault('key', key)
+            now = time.time()
+            self._refill(state, now)
+            result = change(state, now)
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            return result
+
+    def _unavailable(self, e):
+        """Note (once per process) that limits are not applied."""
+        if not self._warned:
+            self._warned = True
+            print(f"   Rate limits not applied, cannot write {self.state_dir}: {e}")
+
+    def _refill(self, state, now):
+        """Top up both buckets for the time elapsed and drop stale leases."""
+        elapsed = max(0.0, now - state.get('updated', now))
+        state['updated'] = now
+        state['run_tokens'] = min(
+            self.runs_per_minute,
+            state.get('run_tokens', self.runs_per_minute) + elapsed * self.runs_per_minute / 60
+        )
+        state['host_tokens'] = min(
+            self.hosts_per_hour,
+            state.get('host_tokens', self.hosts_per_hour) + elapsed * self.hosts_per_hour / 3600
+        )
+        state['leases'] = {
+            lease_id: lease for lease_id, lease in state.get('leases', {}).items()
+            if now - lease['started'] < self.lease_ttl and (lease['pid'] is None or pid_alive(lease['pid']))
+        }
+
+    def acquire(self, key, hosts=0, detached=False):
+        """
+        Admit a run targeting hosts hosts for key, or refuse it. The lease
+        ends with release(), or when this process exits unless detached
+        (a queued job outlives the request that created it); lease_ttl
+        bounds both.
+        Returns (True, lease_id) or (False, {'error': ..., 'retry_after': seconds});
+        lease_id is None when the state directory is unusable.
+        """
+        def change(state, now):
+            if self.max_concurrent and len(state['leases']) >= self.max_concurrent:
+                oldest = min(lease['started'] for lease in state['leases'].values())
+                return False, {
+                    'error': f'Too many concurrent runs (limit {self.max_concurrent})',
+                    'retry_after': max(1, min(60, int(self.lease_ttl - (now - oldest)))),
+                }
+            if self.runs_per_minute and state['run_tokens'] < 1:
+                wait = (1 - state['run_tokens']) * 60 / self.runs_per_minute
+                return False, {
+                    'error': f'Rate limit exceeded ({self.runs_per_minute} runs per minute)',
+                    'retry_after': max(1, int(wait + 0.999)),
+                }
+            if self.hosts_per_hour and hosts > state['host_tokens']:
+                if hosts > self.hosts_per_hour:
+                    return False, {
+                        'error': f'Run targets {hosts} hosts, more than the budget of {self.hosts_per_hour} per hour',
+                        'retry_after': 3600,
+                    }
+                wait = (hosts - state['host_tokens']) * 3600 / self.hosts_per_hour
+                return False, {
+                    'error': f'Host budget exceeded ({self.hosts_per_hour} hosts per hour)',
+                    'retry_after': max(1, int(wait + 0.999)),
+                }
+
+            if self.runs_per_minute:
+                state['run_tokens'] -= 1
+            if self.hosts_per_hour:
+                state['host_tokens'] -= hosts
+            lease_id = uuid.uuid4().hex[:16]
+            state['leases'][lease_id] = {'started': now, 'pid': None if detached else os.getpid(), 'hosts': hosts}
+            state['runs'] = state.get('runs', 0) + 1
+            state['hosts'] = state.get('hosts', 0) + hosts
+            return True, lease_id
+
+        try:
+            return self._update(key, change)
+        except OSError as e:
+            self._unavailable(e)
+            return True, None
+
+    def release(self, key, lease_id):
+        """End a run's concurrency lease."""
+        try:
+            self._update(key, lambda state, now: state['leases'].pop(lease_id, None))
+        except OSError as e:
+            self._unavailable(e)
+
+    def _report(self, state):
+        return {
+            'key': state['key'],
+            'runs_total': state.get('runs', 0),
+            'hosts_total': state.get('hosts', 0),
+            'runs_available': int(state['run_tokens']) if self.runs_per_minute else None,
+            'runs_per_minute': self.runs_per_minute or None,
+            'concurrent': len(state['leases']),
+            'max_concurrent': self.max_concurrent or None,
+            'hosts_available': int(state['host_tokens']) if self.hosts_per_hour else None,
+            'hosts_per_hour': self.hosts_per_hour or None,
+        }
+
+    def usage(self, key):
+        """Current usage and remaining allowance for one caller."""
+        try:
+            return self._update(key, lambda state, now: self._report(state))
+        except OSError as e:
+            self._unavailable(e)
+            state = {'key': key}
+            self._refill(state, time.time())
+            return self._report(state)
+
+    def all_usage(self):
+        """Usage for every caller seen so far, busiest first."""
+        if not os.path.exists(self.state_dir):
+            return []
+        reports = []
+        for f in os.listdir(self.state_dir):
+            if not f.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.state_dir, f), 'r', encoding='utf-8') as state_file:
+                    key = json.load(state_file)['key']
+            except (OSError, ValueError, KeyError):
+                continue
+            reports.append(self.usage(key))
+        reports.sort(key=lambda r: r['runs_total'], reverse=True)
+        return reports
+
+
+def pid_alive(pid):
+    """Whether a process exists on this host."""
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists but owned by someone else
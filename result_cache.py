@@ -0,0 +1,245 @@
+"""
+Ekumen - Result Cache
+Opt-in cache for read-only ad-hoc runs. Identical requests inside the TTL
+get the stored result, and identical requests that arrive while one is
+running wait for it instead of starting their own ansible process.
+
+Threads of one worker share a run in memory. With a cache directory,
+workers also share runs through it:
+    <key>.lock   held (flock) by the worker running the request
+    <key>.json   the last result: {expires, stored, result}
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Seconds between checks while another worker runs the same request
+# (polled rather than blocking, so gevent workers keep serving)
+WAIT_INTERVAL = 0.1
+
+# Result and lock files untouched for this long are removed
+STALE_FILE_AGE = 3600
+
+# Request fields that change what a run returns
+KEY_FIELDS = ('module', 'args', 'limit', 'username', 'become', 'become_method',
+              'become_user', 'verbosity')
+
+
+class _InFlight:
+    """A run in progress that other identical requests can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class ResultCache:
+    """Cache of ad-hoc results keyed by request content, shared by workers through cache_dir."""
+
+    def __init__(self, cacheable_modules, default_ttl=10, max_ttl=300, max_entries=256, cache_dir=None):
+        self.cacheable_modules = set(cacheable_modules)
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        # None = per-process only
+        self.cache_dir = cache_dir
+        self._entries = {}   # key -> (expires_at, stored_at, result)
+        self._in_flight = {}  # key -> _InFlight
+        self._lock = threading.Lock()
+
+    def make_key(self, data):
+        """Return the cache key for a request, or None if it can't be cached."""
+        if not data.get('cache') or data.get('mode', 'adhoc') != 'adhoc':
+            return None
+        if data.get('module', 'ping') not in self.cacheable_modules:
+            return None
+
+        fields = {k: data.get(k) for k in KEY_FIELDS}
+        fields['module'] = data.get('module', 'ping')
+        inventories = data.get('inventory_sources') or [data.get('inventory', '')]
+        fields['inventory'] = hashlib.sha256('\0'.join(i.strip() for i in inventories).encode('utf-8')).hexdigest()
+        # Credentials are part of the key so a cached result is only
+        # served to callers who could have produced it themselves
+        secret = f"{data.get('password', '')}\0{data.get('become_password', '')}"
+        fields['credentials'] = hashlib.sha256(secret.encode('utf-8')).hexdigest()
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_cached(self, data):
+        """Whether a request would be answered without starting a run."""
+        key = self.make_key(data)
+        if key is None:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if key in self._in_flight or (entry and entry[0] > time.time()):
+                return True
+        if not self.cache_dir:
+            return False
+        shared = self._read_shared(key)
+        return bool(shared and shared['expires'] > time.time()) or self._running_elsewhere(key)
+
+    def _ttl(self, data):
+        try:
+            ttl = int(data.get('cache_ttl') or self.default_ttl)
+        except (TypeError, ValueError):
+            ttl = self.default_ttl
+        return max(0, min(ttl, self.max_ttl))
+
+    def get_or_run(self, data, run):
+        """
+        Return run(data), served from cache when possible.
+        The returned dict carries 'cached' and, for hits, 'cache_age'.
+        """
+        key = self.make_key(data)
+        if key is None:
+            return dict(run(data), cached=False)
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return dict(entry[2], cached=True, cache_age=round(now - entry[1], 2))
+
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            flight.done.wait()
+            return dict(flight.result, cached=True, cache_age=0)
+
+        ttl = self._ttl(data)
+        expires = stored = None
+        try:
+            if self.cache_dir:
+                result, expires, stored = self._run_shared(key, data, run, ttl)
+            else:
+                result = run(data)
+            flight.result = result
+        except Exception as e:
+            flight.result = {'success': False, 'output': '', 'error': str(e)}
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                # Only cache runs that reached the hosts, not setup errors
+                if flight.result.get('output'):
+                    now = time.time()
+                    self._store(key, flight.result, expires or now + ttl, stored or now)
+            flight.done.set()
+
+        if stored is not None:
+            # Run by another worker
+            return dict(result, cached=True, cache_age=round(time.time() - stored, 2))
+        return dict(result, cached=False)
+
+    def _store(self, key, result, expires, stored):
+        """Store a result and evict expired or oldest entries. Caller holds the lock."""
+        now = time.time()
+        if expires <= now:
+            return
+        self._entries[key] = (expires, stored, result)
+
+        for k in [k for k, e in self._entries.items() if e[0] <= now]:
+            del self._entries[k]
+        while len(self._entries) > self.max_entries:
+            oldest = min(self._entries, key=lambda k: self._entries[k][1])
+            del self._entries[oldest]
+
+    # ========== SHARED BETWEEN WORKERS ==========
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _read_shared(self, key):
+        try:
+            with open(self._path(key, '.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_shared(self, key, result, ttl):
+        """Publish a result for other workers (atomically, readable by the app user only)."""
+        now = time.time()
+        path = self._path(key, '.json')
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'expires': now + ttl, 'stored': now, 'result': result}, f)
+        os.replace(tmp_path, path)
+        self._prune(now)
+
+    def _prune(self, now):
+        """Remove result and lock files nobody has used for a while."""
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if now - entry.stat().st_mtime > STALE_FILE_AGE:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+    def _running_elsewhere(self, key):
+        """Whether another worker currently holds the run lock for key."""
+        try:
+            with open(self._path(key, '.lock'), 'r') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _run_shared(self, key, data, run, ttl):
+        """
+        Run a request once across workers. The first worker takes the key's
+        lock and runs it; the others wait for the lock and use its result.
+        Returns (result, expires, stored), with expires and stored set only
+        when the result came from another worker.
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            lock_file = open(self._path(key, '.lock'), 'a')
+        except OSError:
+            return run(data), None, None  # Cache directory unusable; run unshared
+
+        with lock_file:
+            waiting_since = time.time()
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    time.sleep(WAIT_INTERVAL)
+            try:
+                os.utime(lock_file.fileno())
+                shared = self._read_shared(key)
+                # A fresh result, or the one the worker we waited for produced
+                if shared and (shared['expires'] > time.time() or (waited and shared['stored'] >= waiting_since)):
+                    return shared['result'], shared['expires'], shared['stored']
+
+                result = run(data)
+                if result.get('output'):
+                    try:
+                        self._write_shared(key, result, ttl)
+                    except OSError:
+                        pass  # Sharing is best effort
+                return result, None, None
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self):
+        """Number of live entries and runs in flight."""
+        now = time.time()
+        with self._lock:
+            return {
+                'entries': len([e for e in self._entries.values() if e[0] > now]),
+                'in_flight': len(self._in_flight),
+            }
@@ -0,0 +1,326 @@
+"""
+Ekumen - Scheduler
+Stores cron-style schedules and enqueues their runs. One gunicorn worker is
+elected leader through a file lock; the others stay on standby and take over
+if the leader exits.
+"""
+
+import datetime
+import fcntl
+import json
+import os
+import random
+import re
+import threading
+import time
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# (minimum, maximum) for minute, hour, day of month, month, day of week
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(field, minimum, maximum):
+    """Expand one cron field into the set of values it matches."""
+    values = set()
+    for part in field.split(','):
+        match = re.match(r'^(\*|\d+(?:-\d+)?)(?:/(\d+))?$', part)
+        if not match:
+            raise ValueError(f'Invalid cron field: {field}')
+
+        span, step = match.group(1), int(match.group(2) or 1)
+        if span == '*':
+            start, end = minimum, maximum
+        elif '-' in span:
+            start, end = (int(v) for v in span.split('-'))
+        else:
+            start = end = int(span)
+            if match.group(2):
+                end = maximum
+
+        if start < minimum or end > maximum or start > end or step < 1:
+            raise ValueError(f'Cron field out of range: {field}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expression):
+    """
+    Parse a 5-field cron expression (or @hourly/@daily/@weekly/@monthly).
+    Returns a tuple of value sets; raises ValueError if invalid.
+    """
+    expression = CRON_ALIASES.get(expression.strip(), expression.strip())
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError('Cron expression must have 5 fields: minute hour day month weekday')
+
+    parsed = [_parse_cron_field(f, lo, hi) for f, (lo, hi) in zip(fields, CRON_RANGES)]
+    if 7 in parsed[4]:
+        parsed[4].add(0)  # Both 0 and 7 mean Sunday
+    # Remember whether day-of-month / day-of-week were restricted (cron OR rule)
+    return tuple(parsed) + (fields[2] != '*', fields[4] != '*')
+
+
+def cron_matches(parsed, moment):
+    """Check whether a parsed cron expression fires at the given minute."""
+    minutes, hours, days, months, weekdays, dom_set, dow_set = parsed
+    if moment.minute not in minutes or moment.hour not in hours or moment.month not in months:
+        return False
+
+    dom_match = moment.day in days
+    dow_match = (moment.isoweekday() % 7) in weekdays
+    if dom_set and dow_set:
+        return dom_match or dow_match
+    return dom_match and dow_match
+
+
+class ScheduleManager:
+    """
+    Manages saved schedules. When a schedule last fired is kept apart from
+    it, in <name>.fired (written only by the scheduler leader), so edits
+    and fire records never overwrite each other.
+    """
+
+    def __init__(self, schedule_dir):
+        self.schedule_dir = schedule_dir
+
+    def _ensure_dir(self):
+        """Create schedule directory if it doesn't exist."""
+        if not os.path.exists(self.schedule_dir):
+            try:
+                os.makedirs(self.schedule_dir, exist_ok=True)
+            except OSError:
+                pass  # May fail on read-only filesystem
+
+    def _sanitize_name(self, name):
+        """Sanitize schedule name to prevent path traversal."""
+        name = re.sub(r'[/\\:*?"<>|]', '', name)
+        if not name.endswith('.json'):
+            name += '.json'
+        return name
+
+    def _fired_path(self, name):
+        return os.path.join(self.schedule_dir, self._sanitize_name(name)[:-len('.json')] + '.fired')
+
+    def _with_last_fired(self, schedule):
+        """Add last_fired from the schedule's fire record (older files kept it inline)."""
+        try:
+            with open(self._fired_path(schedule.get('name', '')), 'r', encoding='utf-8') as f:
+                schedule['last_fired'] = f.read().strip() or None
+        except OSError:
+            schedule.setdefault('last_fired', None)
+        return schedule
+
+    def list_schedules(self):
+        """List all saved schedules."""
+        if not os.path.exists(self.schedule_dir):
+            return []
+
+        schedules = []
+        for f in sorted(os.listdir(self.schedule_dir)):
+            if not f.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.schedule_dir, f), 'r', encoding='utf-8') as fh:
+                    schedules.append(self._with_last_fired(json.load(fh)))
+            except (OSError, ValueError):
+                continue
+        return schedules
+
+    def get_schedule(self, name):
+        """Get a schedule by name. Returns (success, schedule_or_error)."""
+        path = os.path.join(self.schedule_dir, self._sanitize_name(name))
+        if not os.path.exists(path):
+            return False, 'Schedule not found'
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return True, self._with_last_fired(json.load(f))
+        except Exception as e:
+            return False, str(e)
+
+    def mark_fired(self, name, stamp):
+        """Record the minute a schedule last fired. Returns (success, error_or_none)."""
+        path = self._fired_path(name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(stamp)
+            os.replace(tmp_path, path)
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+    def save_schedule(self, schedule):
+        """Validate and save a schedule. Returns (success, name_or_error)."""
+        if not schedule.get('name'):
+            return False, 'Schedule name is required'
+        if not schedule.get('inventory'):
+            return False, 'A saved inventory name is required'
+        try:
+            parse_cron(schedule.get('cron', ''))
+        except ValueError as e:
+            return False, str(e)
+
+        self._ensure_dir()
+        safe_name = self._sanitize_name(schedule['name'])
+        schedule = dict(schedule, name=safe_name[:-len('.json')])
+        schedule.setdefault('enabled', True)
+        schedule.pop('last_fired', None)  # Kept in the fire record, see mark_fired()
+        if not os.path.exists(self._fired_path(schedule['name'])):
+            # Move an inline last_fired (older files) so an edit can't re-fire
+            success, existing = self.get_schedule(schedule['name'])
+            if success and existing.get('last_fired'):
+                self.mark_fired(schedule['name'], existing['last_fired'])
+
+        path = os.path.join(self.schedule_dir, safe_name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(schedule, f)
+            os.replace(tmp_path, path)
+            return True, schedule['name']
+        except Exception as e:
+            return False, str(e)
+
+    def delete_schedule(self, name):
+        """Delete a schedule. Returns (success, error_or_none)."""
+        path = os.path.join(self.schedule_dir, self._sanitize_name(name))
+        if not os.path.exists(path):
+            return False, 'Schedule not found'
+        try:
+            os.remove(path)
+            if os.path.exists(self._fired_path(name)):
+                os.remove(self._fired_path(name))
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+
+class Scheduler:
+    """
+    Background scheduler. Every worker starts one, but only the holder of the
+    leader lock enqueues schedules and runs local jobs.
+    """
+
+    def __init__(self, schedule_manager, job_manager, runner, build_payload,
+                 jitter=60, max_concurrent=4, tick=5, default_route='local'):
+        self.schedule_manager = schedule_manager
+        self.job_manager = job_manager
+        self.runner = runner
+        self.build_payload = build_payload
+        self.jitter = jitter
+        self.max_concurrent = max_concurrent
+        self.tick = tick
+        # Route for schedules that don't name one ('local' = run by the leader)
+        self.default_route = default_route
+        self.is_leader = False
+        self._lock_file = None
+        self._running = set()  # Ids of local jobs this process is running
+        self._running_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread (safe to call more than once)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, name='ekumen-scheduler', daemon=True)
+        self._thread.start()
+
+    def _try_lead(self):
+        """Try to become leader; the lock is held for the life of the process."""
+        if self.is_leader:
+            return True
+        self.schedule_manager._ensure_dir()
+        lock_path = os.path.join(self.schedule_manager.schedule_dir, '.scheduler.lock')
+        try:
+            lock_file = open(lock_path, 'a')
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        return True
+
+    def _loop(self):
+        while True:
+            try:
+                if self._try_lead():
+                    with self._running_lock:
+                        running = list(self._running)
+                    self.job_manager.heartbeat(running)
+                    self._enqueue_due(datetime.datetime.now().replace(second=0, microsecond=0))
+                    self._dispatch_local()
+            except Exception as e:
+                print(f"   Scheduler error: {e}")
+            time.sleep(self.tick)
+
+    def _enqueue_due(self, minute):
+        """Queue a job for every enabled schedule that fires this minute."""
+        stamp = minute.isoformat()
+        # Jobs whose runner died would otherwise block their schedule forever
+        self.job_manager.fail_stale_jobs()
+        active = {
+            j.get('source') for status in ('queued', 'running')
+            for j in self.job_manager.list_jobs(status=status, limit=None)
+        }
+
+        for schedule in self.schedule_manager.list_schedules():
+            if not schedule.get('enabled', True) or schedule.get('last_fired') == stamp:
+                continue
+            try:
+                if not cron_matches(parse_cron(schedule['cron']), minute):
+                    continue
+            except (KeyError, ValueError):
+                continue
+
+            self.schedule_manager.mark_fired(schedule['name'], stamp)
+
+            source = f"schedule:{schedule['name']}"
+            if source in active:
+                continue  # Previous run still queued or running; skip overlap
+
+            success, payload = self.build_payload(schedule)
+            if not success:
+                print(f"   Schedule {schedule['name']} skipped: {payload}")
+                continue
+
+            # Spread runs that share a minute instead of starting them together
+            jitter = schedule.get('jitter', self.jitter)
+            not_before = time.time() + random.uniform(0, max(0, jitter))
+            self.job_manager.create_job(payload, route=schedule.get('route') or self.default_route,
+                                        source=source, not_before=not_before)
+
+    def _dispatch_local(self):
+        """Run queued local jobs while below the concurrency limit."""
+        while True:
+            with self._running_lock:
+                if len(self._running) >= self.max_concurrent:
+                    return
+            job = self.job_manager.claim_job('scheduler', local=True)
+            if not job:
+                return
+            with self._running_lock:
+                self._running.add(job['id'])
+            threading.Thread(target=self._execute, args=(job,), daemon=True).start()
+
+    def _execute(self, job):
+        try:
+            result = self.runner.run(
+                job['payload'],
+                on_output=lambda chunk: self.job_manager.append_output(job['id'], chunk)
+            )
+            self.job_manager.complete_job(job['id'], result)
+        except Exception as e:
+            self.job_manager.complete_job(job['id'], {'success': False, 'error': str(e)})
+        finally:
+            with self._running_lock:
+                self._running.discard(job['id'])
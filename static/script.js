@@ -361,6 +361,67 @@ async function savePlaybook() {
     }
 }
 
+async function analyzePlaybook() {
+    const panel = document.getElementById('playbook-analysis');
+    const playbook = playbookEditor ? playbookEditor.getValue() : document.getElementById('playbook').value;
+
+    if (!playbook.trim()) {
+        showToast('Playbook content is empty', 'error');
+        return;
+    }
+
+    try {
+        const response = await fetch('/playbooks/analyze', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                playbook,
+                inventory: document.getElementById('inventory').value,
+                limit: document.getElementById('limit').value.trim()
+            })
+        });
+        const data = await response.json();
+
+        if (!data.success) {
+            panel.innerHTML = `<span class="warning">⚠️ ${escapeHtml(data.error)}</span>`;
+            panel.classList.remove('hidden');
+            return;
+        }
+
+        const a = data.analysis;
+        let html = `<strong>${a.plays.length} play(s), ${a.task_count} task(s)</strong>`;
+        if (a.target_hosts !== undefined) {
+            html += ` on ${a.target_hosts} host(s), about <strong>${a.estimated_task_runs}</strong> task runs`;
+        }
+        html += '<ul>';
+        a.plays.forEach(play => {
+            const hosts = play.estimated_hosts !== undefined ? ` × ${play.estimated_hosts} host(s)` : '';
+            html += `<li>${escapeHtml(play.name || play.hosts)}: ${play.tasks} task(s)${hosts}</li>`;
+        });
+        html += '</ul>';
+        if (a.tags.length) {
+            html += `<div>Tags: ${escapeHtml(a.tags.join(', '))}</div>`;
+        }
+        if (a.unsafe_modules.length) {
+            html += `<div class="warning">⚠️ Modules outside the allowed list: ${escapeHtml(a.unsafe_modules.join(', '))}</div>`;
+        }
+        if (a.roles.length) {
+            html += `<div class="warning">⚠️ Role tasks are not counted: ${escapeHtml(a.roles.join(', '))}</div>`;
+        }
+        if (a.shard_blockers.length) {
+            html += `<div class="warning">⚠️ Will not be sharded: ${escapeHtml(a.shard_blockers.join('; '))}</div>`;
+        }
+        if (a.unresolved_includes.length) {
+            const files = a.unresolved_includes.map(i => `${i.file} (${i.reason})`).join(', ');
+            html += `<div class="warning">⚠️ Includes not analyzed: ${escapeHtml(files)}</div>`;
+        }
+        panel.innerHTML = html;
+        panel.classList.remove('hidden');
+    } catch (error) {
+        showToast('Failed to analyze: ' + error.message, 'error');
+    }
+}
+
 async function deletePlaybook() {
     if (!currentLoadedPlaybook) return;
 
@@ -439,6 +500,8 @@ async function runAnsible() {
         verbosity: document.getElementById('verbosity').value,
         inventory: document.getElementById('inventory').value,
         limit: document.getElementById('limit').value.trim(), // --limit option
+        sharded: document.getElementById('shards').value !== '',
+        shards: parseInt(document.getElementById('shards').value, 10) || 0,
         username: document.getElementById('username').value,
         password: document.getElementById('password').value,
         // Default: use sudo with same credentials
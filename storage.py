@@ -0,0 +1,137 @@
+"""
+Ekumen - Versioned Storage
+Content-addressed storage for saved playbooks and inventories.
+
+Layout under the library directory:
+    <name>                      current content (replaced atomically)
+    .objects/ab/cdef...         blobs named by SHA-256 of their content
+    .versions/<name>.json       version list: [{hash, size, saved}, ...]
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def atomic_write(path, data):
+    """Write bytes to path via a temp file and rename, so readers never see a partial file."""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class VersionedStore:
+    """Stores named files with deduplicated, content-addressed history."""
+
+    def __init__(self, root):
+        self.root = root
+        self.object_dir = os.path.join(root, '.objects')
+        self.version_dir = os.path.join(root, '.versions')
+
+    def _ensure_dirs(self):
+        for path in (self.root, self.object_dir, self.version_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.object_dir, digest[:2], digest[2:])
+
+    def _manifest_path(self, name):
+        return os.path.join(self.version_dir, name + '.json')
+
+    def write(self, name, content):
+        """
+        Save content under name and record it as a new version.
+        Saving content identical to the latest version adds no new version.
+        Returns (success, hash_or_error).
+        """
+        data = content.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+
+        try:
+            self._ensure_dirs()
+            blob_path = self._blob_path(digest)
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                atomic_write(blob_path, data)
+
+            with open(self._manifest_path(name) + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                versions = self.versions(name)
+                if not versions or versions[-1]['hash'] != digest:
+                    versions.append({'hash': digest, 'size': len(data), 'saved': time.time()})
+                    atomic_write(self._manifest_path(name), json.dumps(versions).encode('utf-8'))
+                atomic_write(os.path.join(self.root, name), data)
+            return True, digest
+        except Exception as e:
+            return False, str(e)
+
+    def versions(self, name):
+        """Version list for name, oldest first (reads only the manifest)."""
+        try:
+            with open(self._manifest_path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def resolve(self, name, version):
+        """Resolve a full hash, unique hash prefix or 1-based index to a hash."""
+        versions = self.versions(name)
+        if str(version).isdigit() and len(str(version)) < 7:
+            index = int(version)
+            return versions[index - 1]['hash'] if 0 < index <= len(versions) else None
+        matches = [v['hash'] for v in versions if v['hash'].startswith(str(version))]
+        return matches[0] if len(matches) == 1 else None
+
+    def _read_blob(self, digest):
+        with open(self._blob_path(digest), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def read_version(self, name, version):
+        """Read the content of one version. Returns (success, content_or_error)."""
+        digest = self.resolve(name, version)
+        if not digest:
+            return False, 'Version not found'
+        try:
+            return True, self._read_blob(digest)
+        except Exception as e:
+            return False, str(e)
+
+    def diff(self, name, from_version=None, to_version=None):
+        """
+        Unified diff between two versions (default: the one before to_version,
+        and the latest). Only the two blobs involved are read.
+        Returns (success, diff_or_error).
+        """
+        versions = self.versions(name)
+        if not versions:
+            return False, 'No versions recorded'
+
+        hashes = [v['hash'] for v in versions]
+        to_digest = self.resolve(name, to_version) if to_version else hashes[-1]
+        if from_version:
+            from_digest = self.resolve(name, from_version)
+        elif to_digest in hashes and hashes.index(to_digest) > 0:
+            from_digest = hashes[hashes.index(to_digest) - 1]
+        else:
+            from_digest = to_digest
+        if not (from_digest and to_digest):
+            return False, 'Version not found'
+
+        try:
+            old, new = self._read_blob(from_digest), self._read_blob(to_digest)
+        except Exception as e:
+            return False, str(e)
+
+        import difflib
+
+        diff = difflib.unified_diff(
+            old.splitlines(), new.splitlines(),
+            fromfile=f'{name}@{from_digest[:12]}', tofile=f'{name}@{to_digest[:12]}', lineterm=''
+        )
+        return True, '\n'.join(diff)